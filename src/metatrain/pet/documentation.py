@@ -95,6 +95,41 @@ from ``atoms.info``:
     atoms.calc = MetatomicCalculator("model.pt")
     energy = atoms.get_potential_energy()
 
+Faster evaluation from Python
+-----------------------------
+
+When a PET model is evaluated from Python (for example when running molecular dynamics
+with a checkpoint loaded in memory), a few opt-in settings of ``model.backend`` can make
+the evaluation faster. They are not hyperparameters, are not saved in checkpoints, and
+have no effect on exported models:
+
+- ``backend.autocast_dtype = torch.bfloat16`` runs the GNN layers under
+  ``torch.autocast`` in the given reduced-precision dtype. The features are cast back to
+  the dtype of the model before the heads, so the outputs keep the model dtype, but
+  with a reduced accuracy.
+- ``backend.reuse_graph = True`` reuses the matching between each edge and the
+  reversed edge from the previous evaluation when the neighbor list did not change,
+  which is common between successive molecular dynamics steps. This costs one
+  synchronization with the device per evaluation, and should not be used when the
+  same model is evaluated concurrently from multiple threads.
+- ``backend.bucket_nef_width = True`` pads the number of neighbors per atom to a power
+  of two, which never shrinks between calls. The shapes of the tensors in the GNN layers
+  then only change when the number of atoms changes or when the number of neighbors
+  grows past the next power of two.
+- ``backend.compile_calculate_features()`` compiles the GNN layers with
+  ``torch.compile`` and static shapes. With the default ``mode="reduce-overhead"``, the
+  compiled featurizer is replayed as CUDA graphs, which removes most of the kernel
+  launch overhead when evaluating small systems on GPU. This also enables
+  ``bucket_nef_width``. Use ``del backend.calculate_features`` to go back to the eager
+  featurizer.
+
+.. code-block:: python
+
+    from metatrain.utils.io import load_model
+
+    model = load_model("model.ckpt").to("cuda").eval()
+    model.backend.compile_calculate_features()
+
 {{SECTION_DEFAULT_HYPERS}}
 
 Tuning hyperparameters
@@ -29,7 +29,7 @@ from metatrain.utils.finetuning import apply_finetuning_strategy
 from metatrain.utils.long_range import DummyLongRangeFeaturizer, LongRangeFeaturizer
 from metatrain.utils.metadata import merge_metadata
 from metatrain.utils.scaler import Scaler
-from metatrain.utils.sum_over_atoms import sum_over_atoms
+from metatrain.utils.sum_over_atoms import sum_over_atoms, sum_values_over_atoms
 
 from . import checkpoints
 from .documentation import ModelHypers
@@ -66,6 +66,15 @@ class PET(ModelInterface[ModelHypers]):
         references={"architecture": ["https://arxiv.org/abs/2305.19302v3"]}
     )
     component_labels: Dict[str, List[List[Labels]]]
+    _labels_by_device: Dict[
+        str,
+        Tuple[
+            Labels,
+            Dict[str, Labels],
+            Dict[str, List[List[Labels]]],
+            Dict[str, List[Labels]],
+        ],
+    ]
     NUM_FEATURE_TYPES: int = 2  # node + edge features
 
     def __init__(self, hypers: ModelHypers, dataset_info: DatasetInfo) -> None:
@@ -131,6 +140,9 @@ class PET(ModelInterface[ModelHypers]):
         train_dataset_info = self._train_dataset_info(dataset_info)
 
         self.output_shapes: Dict[str, Dict[str, List[int]]] = {}
+        # Copies of the output labels on every device the model was used on, keyed by
+        # device name, see ``_move_labels_to_device``.
+        self._labels_by_device = {}
         self.key_labels: Dict[str, Labels] = {}
         self.property_labels: Dict[str, List[Labels]] = {}
         self.component_labels: Dict[str, List[List[Labels]]] = {}
@@ -392,6 +404,30 @@ class PET(ModelInterface[ModelHypers]):
                 sample_labels,
             ) = concatenate_structures(systems, nl_options)
 
+        # Samples of the per-system outputs, shared by all the outputs that are summed
+        # over atoms directly from their dense values (see ``sum_values_over_atoms``),
+        # i.e. per-system outputs without ``selected_atoms``. As with
+        # ``sum_over_atoms``, systems without atoms after the last system with atoms are
+        # not included. This is found from the number of atoms of the systems on the
+        # host, without reading the system indices back from the device.
+        system_sample_labels: Optional[Labels] = None
+        if selected_atoms is None:
+            has_per_system_outputs = False
+            for output in outputs.values():
+                if output.sample_kind != "atom":
+                    has_per_system_outputs = True
+            if has_per_system_outputs:
+                n_summed_systems = len(systems)
+                while n_summed_systems > 0 and len(systems[n_summed_systems - 1]) == 0:
+                    n_summed_systems -= 1
+                system_sample_labels = Labels(
+                    names=["system"],
+                    values=torch.arange(
+                        n_summed_systems, device=device, dtype=torch.int32
+                    ).reshape(-1, 1),
+                    assume_unique=True,
+                )
+
         with torch.profiler.record_function("PET::backend::preprocess"):
             batch_data = self.backend.preprocess(
                 positions,
@@ -492,9 +528,19 @@ class PET(ModelInterface[ModelHypers]):
                     batch_data["padding_mask"],
                 )
                 for i in range(self.num_readout_layers):
-                    node_features_list[i] = (
-                        node_features_list[i] + long_range_features
-                    ) * 0.5**0.5
+                    node_features_list[i] = torch.add(
+                        node_features_list[i], long_range_features
+                    ).mul_(0.5**0.5)
+
+        # The additive models only depend on the systems, not on the features. On
+        # CUDA, they are launched on a side stream here so that they run concurrently
+        # with the last layers, and are joined before their contributions are added.
+        additive_contributions: Optional[Dict[str, List[TensorMap]]] = None
+        if not torch.jit.is_scripting():
+            if not self.training and device.type == "cuda":
+                additive_contributions = self._launch_additive_models_on_side_stream(
+                    systems, outputs, selected_atoms
+                )
 
         # **Stages 3 & 4: Last Layer Features and Atomic Predictions**
         with torch.profiler.record_function("PET::predict"):
@@ -513,6 +559,7 @@ class PET(ModelInterface[ModelHypers]):
                 cells,
                 system_indices,
                 requested_target_names,
+                capture_diagnostics=_capture_diagnostics,
             )
 
         # **Stage 2: Intermediate Feature Output (Optional)**
@@ -524,6 +571,8 @@ class PET(ModelInterface[ModelHypers]):
                     batch_data["cutoff_factors"],
                     selected_atoms,
                     sample_labels,
+                    system_indices,
+                    system_sample_labels,
                     outputs,
                 )
                 # Since return_dict.update(features_dict) is not Torch-Scriptable,
@@ -539,6 +588,8 @@ class PET(ModelInterface[ModelHypers]):
                 batch_data["cutoff_factors"],
                 selected_atoms,
                 sample_labels,
+                system_indices,
+                system_sample_labels,
                 outputs,
             )
 
@@ -550,6 +601,8 @@ class PET(ModelInterface[ModelHypers]):
             atomic_predictions_dict = self._get_output_atomic_predictions(
                 atomic_predictions,
                 sample_labels,
+                system_indices,
+                system_sample_labels,
                 outputs,
                 selected_atoms,
             )
@@ -592,54 +645,119 @@ class PET(ModelInterface[ModelHypers]):
                             species,
                         )
 
-                for additive_model in self.additive_models:
-                    outputs_for_additive_model: Dict[str, ModelOutput] = {}
-                    for name, output in outputs.items():
-                        if name in additive_model.outputs:
-                            outputs_for_additive_model[name] = output
-                    additive_contributions = additive_model(
-                        systems,
-                        outputs_for_additive_model,
-                        selected_atoms,
+                if additive_contributions is None:
+                    all_contributions = self._compute_additive_contributions(
+                        systems, outputs, selected_atoms
                     )
-                    for name in additive_contributions:
-                        # TODO: uncomment this after metatensor.torch.add
-                        # is updated to handle sparse sums
-                        # return_dict[name] = metatensor.torch.add(
-                        #     return_dict[name],
-                        #     additive_contributions[name].to(
-                        #         device=return_dict[name].device,
-                        #         dtype=return_dict[name].dtype
-                        #         ),
-                        # )
-                        # TODO: "manual" sparse sum: update to metatensor.torch.add
-                        # after sparse sum is implemented in metatensor.operations
-                        output_blocks: List[TensorBlock] = []
-                        for k, b in return_dict[name].items():
-                            if k in additive_contributions[name].keys:
-                                output_blocks.append(
-                                    _add_block_block(
-                                        b,
-                                        additive_contributions[name]
-                                        .block(k)
-                                        .to(device=b.device, dtype=b.dtype),
-                                    )
+                else:
+                    if not torch.jit.is_scripting():
+                        _join_side_stream(device)
+                    all_contributions = additive_contributions
+
+                for name, contributions in all_contributions.items():
+                    # TODO: use metatensor.torch.add once it handles sparse sums:
+                    # the additive contributions may only contain a subset of the
+                    # blocks of the model output.
+                    output_blocks: List[TensorBlock] = []
+                    for k, b in return_dict[name].items():
+                        block = b
+                        was_added = False
+                        for contribution in contributions:
+                            if k in contribution.keys:
+                                block = _add_block_block(
+                                    block,
+                                    contribution.block(k).to(
+                                        device=b.device, dtype=b.dtype
+                                    ),
                                 )
-                            else:
-                                output_blocks.append(
-                                    TensorBlock(
-                                        values=b.values,
-                                        samples=b.samples,
-                                        components=b.components,
-                                        properties=b.properties,
-                                    )
-                                )
-                        return_dict[name] = TensorMap(
-                            return_dict[name].keys, output_blocks
-                        )
+                                was_added = True
+                        if not was_added:
+                            block = TensorBlock(
+                                values=b.values,
+                                samples=b.samples,
+                                components=b.components,
+                                properties=b.properties,
+                            )
+                        output_blocks.append(block)
+                    return_dict[name] = TensorMap(return_dict[name].keys, output_blocks)
 
         return return_dict
 
+    def _compute_additive_contributions(
+        self,
+        systems: List[System],
+        outputs: Dict[str, ModelOutput],
+        selected_atoms: Optional[Labels],
+    ) -> Dict[str, List[TensorMap]]:
+        """
+        Evaluate the additive models on the requested outputs they support.
+
+        The contributions of all additive models are collected first, so that each
+        output is rebuilt only once, however many additive models contribute to it.
+
+        :param systems: List of systems to evaluate the additive models on.
+        :param outputs: Dictionary of requested outputs.
+        :param selected_atoms: Optional labels of the selected atoms.
+        :return: Dictionary mapping each output name to the list of contributions of
+            the additive models to this output.
+        """
+        additive_contributions: Dict[str, List[TensorMap]] = {}
+        for additive_model in self.additive_models:
+            outputs_for_additive_model: Dict[str, ModelOutput] = {}
+            for name, output in outputs.items():
+                if name in additive_model.outputs:
+                    outputs_for_additive_model[name] = output
+            # TorchScript unrolls the loops over module lists, which can then not use
+            # ``continue``
+            if len(outputs_for_additive_model) > 0:
+                contributions = additive_model(
+                    systems,
+                    outputs_for_additive_model,
+                    selected_atoms,
+                )
+                for name, contribution in contributions.items():
+                    if name in additive_contributions:
+                        additive_contributions[name].append(contribution)
+                    else:
+                        additive_contributions[name] = [contribution]
+        return additive_contributions
+
+    @torch.jit.unused
+    def _launch_additive_models_on_side_stream(
+        self,
+        systems: List[System],
+        outputs: Dict[str, ModelOutput],
+        selected_atoms: Optional[Labels],
+    ) -> Dict[str, List[TensorMap]]:
+        """
+        Launch :py:meth:`_compute_additive_contributions` on a side CUDA stream.
+
+        The side stream first waits for the work already queued on the current stream
+        (which produced the inputs). The caller must call :py:func:`_join_side_stream`
+        before using the returned contributions.
+
+        :param systems: List of systems to evaluate the additive models on.
+        :param outputs: Dictionary of requested outputs.
+        :param selected_atoms: Optional labels of the selected atoms.
+        :return: Dictionary mapping each output name to the list of contributions of
+            the additive models to this output.
+        """
+        device = systems[0].positions.device
+        current_stream = torch.cuda.current_stream(device)
+        side_stream = _get_side_stream(device)
+        side_stream.wait_stream(current_stream)
+        with torch.cuda.stream(side_stream):
+            additive_contributions = self._compute_additive_contributions(
+                systems, outputs, selected_atoms
+            )
+        # the contributions are allocated on the side stream but consumed on the
+        # current one, which the caching allocator must know before reusing them
+        for contributions in additive_contributions.values():
+            for contribution in contributions:
+                for block in contribution.blocks():
+                    block.values.record_stream(current_stream)
+        return additive_contributions
+
     def _calculate_long_range_features(
         self,
         systems: List[System],
@@ -713,6 +831,8 @@ class PET(ModelInterface[ModelHypers]):
         cutoff_factors: torch.Tensor,
         selected_atoms: Optional[Labels],
         sample_labels: Labels,
+        system_indices: torch.Tensor,
+        system_sample_labels: Optional[Labels],
         requested_outputs: Dict[str, ModelOutput],
     ) -> Dict[str, TensorMap]:
         """
@@ -725,6 +845,10 @@ class PET(ModelInterface[ModelHypers]):
             [n_atoms, max_num_neighbors].
         :param selected_atoms: Optional Labels specifying a subset of atoms to include.
         :param sample_labels: Labels for all atoms in the batch [n_atoms, 2].
+        :param system_indices: System index for each atom [n_atoms].
+        :param system_sample_labels: Labels for all systems in the batch [n_systems, 1],
+            only built (i.e. not ``None``) when per-system outputs are requested without
+            ``selected_atoms``.
         :param requested_outputs: Dictionary of requested outputs.
         :return: Dictionary mapping "feature" to a TensorMap of intermediate
             representations, either per-atom or summed over atoms.
@@ -735,12 +859,21 @@ class PET(ModelInterface[ModelHypers]):
         edge_features = (edge_features * cutoff_factors[:, :, None]).sum(dim=1)
         features = torch.cat([node_features, edge_features], dim=1)
 
+        per_atom = requested_outputs["feature"].sample_kind == "atom"
+        samples = sample_labels
+        if selected_atoms is None and not per_atom:
+            assert system_sample_labels is not None
+            features = sum_values_over_atoms(
+                features, system_indices, system_sample_labels.values.shape[0]
+            )
+            samples = system_sample_labels
+
         feature_tmap = TensorMap(
             keys=self.single_label,
             blocks=[
                 TensorBlock(
                     values=features,
-                    samples=sample_labels,
+                    samples=samples,
                     components=[],
                     properties=Labels(
                         names=["feature"],
@@ -758,10 +891,9 @@ class PET(ModelInterface[ModelHypers]):
                 axis="samples",
                 selection=selected_atoms,
             )
-        if requested_outputs["feature"].sample_kind == "atom":
-            features_dict["feature"] = feature_tmap
-        else:
-            features_dict["feature"] = sum_over_atoms(feature_tmap)
+            if not per_atom:
+                feature_tmap = sum_over_atoms(feature_tmap)
+        features_dict["feature"] = feature_tmap
         return features_dict
 
     def _get_output_last_layer_features(
@@ -771,6 +903,8 @@ class PET(ModelInterface[ModelHypers]):
         cutoff_factors: torch.Tensor,
         selected_atoms: Optional[Labels],
         sample_labels: Labels,
+        system_indices: torch.Tensor,
+        system_sample_labels: Optional[Labels],
         requested_outputs: Dict[str, ModelOutput],
     ) -> Dict[str, TensorMap]:
         """
@@ -785,6 +919,10 @@ class PET(ModelInterface[ModelHypers]):
             [n_atoms, max_num_neighbors].
         :param selected_atoms: Optional Labels specifying a subset of atoms to include.
         :param sample_labels: Labels for all atoms in the batch [n_atoms, 2].
+        :param system_indices: System index for each atom [n_atoms].
+        :param system_sample_labels: Labels for all systems in the batch [n_systems, 1],
+            only built (i.e. not ``None``) when per-system outputs are requested without
+            ``selected_atoms``.
         :param requested_outputs: Dictionary of requested outputs.
         :return: Dictionary mapping requested last layer features output names
             to TensorMaps of last layer features, either per-atom or summed over atoms.
@@ -820,12 +958,22 @@ class PET(ModelInterface[ModelHypers]):
             last_layer_features_values = torch.cat(
                 last_layer_features_dict[base_name], dim=1
             )
+            per_atom = requested_outputs[output_name].sample_kind == "atom"
+            samples = sample_labels
+            if selected_atoms is None and not per_atom:
+                assert system_sample_labels is not None
+                last_layer_features_values = sum_values_over_atoms(
+                    last_layer_features_values,
+                    system_indices,
+                    system_sample_labels.values.shape[0],
+                )
+                samples = system_sample_labels
             last_layer_feature_tmap = TensorMap(
                 keys=self.single_label,
                 blocks=[
                     TensorBlock(
                         values=last_layer_features_values,
-                        samples=sample_labels,
+                        samples=samples,
                         components=[],
                         properties=Labels(
                             names=["feature"],
@@ -844,19 +992,17 @@ class PET(ModelInterface[ModelHypers]):
                     axis="samples",
                     selection=selected_atoms,
                 )
-            last_layer_features_options = requested_outputs[output_name]
-            if last_layer_features_options.sample_kind == "atom":
-                last_layer_features_outputs[output_name] = last_layer_feature_tmap
-            else:
-                last_layer_features_outputs[output_name] = sum_over_atoms(
-                    last_layer_feature_tmap
-                )
+                if not per_atom:
+                    last_layer_feature_tmap = sum_over_atoms(last_layer_feature_tmap)
+            last_layer_features_outputs[output_name] = last_layer_feature_tmap
         return last_layer_features_outputs
 
     def _get_output_atomic_predictions(
         self,
         atomic_predictions: Dict[str, List[torch.Tensor]],
         sample_labels: Labels,
+        system_indices: torch.Tensor,
+        system_sample_labels: Optional[Labels],
         outputs: Dict[str, ModelOutput],
         selected_atoms: Optional[Labels],
     ) -> Dict[str, TensorMap]:
@@ -869,14 +1015,28 @@ class PET(ModelInterface[ModelHypers]):
             and edge contributions are already summed and rank-2 Cartesian tensors are
             already symmetrized).
         :param sample_labels: Labels for all atoms in the batch [n_atoms, 2].
+        :param system_indices: System index for each atom [n_atoms].
+        :param system_sample_labels: Labels for all systems in the batch [n_systems, 1],
+            only built (i.e. not ``None``) when per-system outputs are requested without
+            ``selected_atoms``.
         :param outputs: Dictionary of requested outputs.
         :param selected_atoms: Optional Labels specifying a subset of atoms to include.
         :return: Dictionary mapping requested output names to TensorMaps of
             predictions, either per-atom or summed over atoms.
         """
         atomic_predictions_tmap_dict: Dict[str, TensorMap] = {}
+        # Outputs that are summed over atoms without selecting atoms first are summed
+        # directly on the dense values of each block, which avoids building the
+        # per-atom ``TensorMap`` only to reduce it with ``sum_over_atoms``.
+        summed_output_names: List[str] = []
         for output_name in self.target_names:
             if output_name in outputs:
+                sum_over_systems = (
+                    selected_atoms is None
+                    and outputs[output_name].sample_kind != "atom"
+                )
+                if sum_over_systems:
+                    summed_output_names.append(output_name)
                 prediction_blocks = atomic_predictions[output_name]
                 blocks: List[TensorBlock] = []
                 block_index = 0
@@ -886,10 +1046,18 @@ class PET(ModelInterface[ModelHypers]):
                     self.property_labels[output_name],
                     strict=True,
                 ):
+                    values = prediction_blocks[block_index].reshape([-1] + shape)
+                    samples = sample_labels
+                    if sum_over_systems:
+                        assert system_sample_labels is not None
+                        values = sum_values_over_atoms(
+                            values, system_indices, system_sample_labels.values.shape[0]
+                        )
+                        samples = system_sample_labels
                     blocks.append(
                         TensorBlock(
-                            values=prediction_blocks[block_index].reshape([-1] + shape),
-                            samples=sample_labels,
+                            values=values,
+                            samples=samples,
                             components=components,
                             properties=properties,
                         )
@@ -915,7 +1083,7 @@ class PET(ModelInterface[ModelHypers]):
         for output_name, atomic_property in atomic_predictions_tmap_dict.items():
             if outputs[output_name].sample_kind == "atom":
                 atomic_predictions_tmap_dict[output_name] = atomic_property
-            else:
+            elif output_name not in summed_output_names:
                 atomic_predictions_tmap_dict[output_name] = sum_over_atoms(
                     atomic_property
                 )
@@ -974,6 +1142,16 @@ class PET(ModelInterface[ModelHypers]):
         # be registered correctly with Pytorch. This function moves them:
         self.additive_models[0].weights_to(torch.device("cpu"), torch.float64)
 
+        # Only keep the labels on the current device in the exported model, and do
+        # not store the edges of the last evaluated batch in it
+        self._labels_by_device = {}
+        self.backend.clear_corresponding_edges_cache()
+
+        # The featurizer compiled by ``compile_calculate_features`` is an instance
+        # attribute which can not be exported, so go back to the eager featurizer
+        if "calculate_features" in self.backend.__dict__:
+            del self.backend.calculate_features
+
         interaction_ranges = [self.num_gnn_layers * self.cutoff]
         for additive_model in self.additive_models:
             if hasattr(additive_model, "cutoff_radius"):
@@ -1049,6 +1227,8 @@ class PET(ModelInterface[ModelHypers]):
         self.outputs[ll_features_name] = ModelOutput(
             sample_kind="atom", description=f"last layer features for {target_name}"
         )
+        # the copies of the labels on other devices do not know about this output
+        self._labels_by_device = {}
         self.key_labels[target_name] = target_info.layout.keys
         self.component_labels[target_name] = [
             block.components for block in target_info.layout.blocks()
@@ -1058,6 +1238,26 @@ class PET(ModelInterface[ModelHypers]):
         ]
 
     def _move_labels_to_device(self, device: torch.device) -> None:
+        # The labels are only copied the first time the model is used on a given
+        # device. Afterwards, switching back and forth between devices just swaps
+        # the cached copies.
+        current_device = str(self.single_label.values.device)
+        if current_device not in self._labels_by_device:
+            self._labels_by_device[current_device] = (
+                self.single_label,
+                self.key_labels,
+                self.component_labels,
+                self.property_labels,
+            )
+
+        cached = self._labels_by_device.get(str(device))
+        if cached is not None:
+            self.single_label = cached[0]
+            self.key_labels = cached[1]
+            self.component_labels = cached[2]
+            self.property_labels = cached[3]
+            return
+
         self.single_label = self.single_label.to(device)
         self.key_labels = {
             output_name: label.to(device)
@@ -1074,6 +1274,12 @@ class PET(ModelInterface[ModelHypers]):
             output_name: [labels.to(device) for labels in properties_tmap]
             for output_name, properties_tmap in self.property_labels.items()
         }
+        self._labels_by_device[str(device)] = (
+            self.single_label,
+            self.key_labels,
+            self.component_labels,
+            self.property_labels,
+        )
 
     @classmethod
     def upgrade_checkpoint(cls, checkpoint: Dict) -> Dict:
@@ -1111,6 +1317,33 @@ class PET(ModelInterface[ModelHypers]):
         return checkpoint
 
 
+# Side CUDA streams used to run the additive models concurrently with the rest of the
+# model, created lazily (once per device) and kept out of the modules to not interfere
+# with their (de)serialization.
+_SIDE_STREAMS: Dict[torch.device, "torch.cuda.Stream"] = {}
+
+
+def _get_side_stream(device: torch.device) -> "torch.cuda.Stream":
+    """
+    Get the side CUDA stream for ``device``, creating it on first use.
+
+    :param device: CUDA device of the stream.
+    :return: The side stream for this device.
+    """
+    if device not in _SIDE_STREAMS:
+        _SIDE_STREAMS[device] = torch.cuda.Stream(device)
+    return _SIDE_STREAMS[device]
+
+
+def _join_side_stream(device: torch.device) -> None:
+    """
+    Make the current CUDA stream wait for the work queued on the side stream.
+
+    :param device: CUDA device of the streams.
+    """
+    torch.cuda.current_stream(device).wait_stream(_get_side_stream(device))
+
+
 def _extract_charge_spin_multiplicity(
     systems: List[System], device: torch.device
 ) -> Tuple[torch.Tensor, torch.Tensor]:
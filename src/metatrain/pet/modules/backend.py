@@ -1,3 +1,4 @@
+import warnings
 from math import prod
 from typing import Dict, List, Optional, Tuple
 
@@ -5,6 +6,7 @@ import torch
 
 from ..documentation import ModelHypers
 from .conditioning import SystemConditioningEmbedding
+from .nef import reverse_nef_array
 from .structures import compute_batch_tensors
 from .transformer import CartesianTransformer
 
@@ -30,6 +32,9 @@ class PETBackend(torch.nn.Module):
     """
 
     NUM_FEATURE_TYPES: int = 2  # node + edge features
+    _corresponding_edges_cache: List[torch.Tensor]
+    _nef_width_bucket: int
+    autocast_dtype: Optional[torch.dtype]
 
     def __init__(self, hypers: ModelHypers, atomic_types: List[int]) -> None:
         super().__init__()
@@ -62,10 +67,13 @@ class PETBackend(torch.nn.Module):
 
         # ``species_to_species_index`` is registered first so that it remains the first
         # entry of the ``state_dict`` (an integer buffer), which the checkpoint dtype
-        # probe in ``PET.load_checkpoint`` relies on.
+        # probe in ``PET.load_checkpoint`` relies on. It is stored as ``int32`` (the
+        # narrowest index type accepted by ``torch.nn.Embedding``), so that the species
+        # indices scattered to the (large) NEF grid take half the memory and bandwidth
+        # of ``int64`` ones, while still being usable directly by the embedding layers.
         self.register_buffer(
             "species_to_species_index",
-            torch.full((max(atomic_types) + 1,), -1),
+            torch.full((max(atomic_types) + 1,), -1, dtype=torch.int32),
         )
         for i, species in enumerate(atomic_types):
             self.species_to_species_index[species] = i
@@ -129,6 +137,32 @@ class PETBackend(torch.nn.Module):
         else:
             self.system_conditioning = None
 
+        # When ``reuse_graph`` is set, the result of the last call to
+        # ``get_corresponding_edges`` is reused in evaluation mode when the next batch
+        # has exactly the same edges (e.g. successive MD steps). Checking the edges
+        # costs one synchronization with the device per call, and the cache is updated
+        # during the forward pass, so this is disabled by default, and ignored in
+        # TorchScript. The cache is a plain attribute, so it is not part of the
+        # ``state_dict``.
+        self.reuse_graph = False
+        self._corresponding_edges_cache = []
+
+        # When ``bucket_nef_width`` is set, the second dimension of the NEF arrays is
+        # padded to a power of two, which never shrinks between calls. The shapes seen
+        # by the featurizer then only change when the largest neighbor count crosses a
+        # power of two, so that compiled kernels or captured CUDA graphs specialized on
+        # these shapes are only rebuilt when the bucket grows. This is disabled by
+        # default, since the extra padding costs compute for varying batches.
+        self.bucket_nef_width = False
+        self._nef_width_bucket = 0
+
+        # Optional reduced-precision dtype (e.g. ``torch.bfloat16``) in which the GNN
+        # layers are run under ``torch.autocast`` by :meth:`calculate_features`. The
+        # returned features are cast back to the dtype of the inputs, so that the heads,
+        # the last layers and the sums over atoms stay in full precision. This is
+        # disabled by default, and ignored in TorchScript.
+        self.autocast_dtype = None
+
         # Per-output heads and last layers, populated by ``PET._add_output``.
         self.node_heads = torch.nn.ModuleDict()
         self.edge_heads = torch.nn.ModuleDict()
@@ -216,6 +250,29 @@ class PETBackend(torch.nn.Module):
             ]
         )
 
+    def train(self, mode: bool = True) -> "PETBackend":
+        """
+        Set the training mode of the backend, see :py:meth:`torch.nn.Module.train`.
+
+        The cached corresponding edges are only used in evaluation mode, so they are
+        dropped when switching to training mode, instead of keeping edge-sized tensors
+        alive on the device.
+
+        :param mode: Whether to set training mode (``True``) or evaluation mode
+            (``False``).
+        :return: The backend itself.
+        """
+        if mode:
+            self.clear_corresponding_edges_cache()
+        return super().train(mode)
+
+    def clear_corresponding_edges_cache(self) -> None:
+        """
+        Drop the corresponding edges cached by :py:meth:`preprocess` in evaluation
+        mode, together with the edges they were computed for.
+        """
+        self._corresponding_edges_cache.clear()
+
     def preprocess(
         self,
         positions: torch.Tensor,
@@ -275,6 +332,27 @@ class PETBackend(torch.nn.Module):
             shape ``(n_edges, 3)``. Columns correspond to ``(cell_shift_a, cell_shift_b,
             cell_shift_c)``. Suitable for use with :func:`get_pair_sample_labels`.
         """
+        # The corresponding edges only depend on the neighbor list, so they can be
+        # reused across evaluations of the same structure when ``reuse_graph`` is set.
+        # The cache is not used in training (where the batches always change), in
+        # TorchScript, or under ``torch.compile`` (where the equality check would be a
+        # data-dependent graph break).
+        corresponding_edges_cache: Optional[List[torch.Tensor]] = None
+        if not torch.jit.is_scripting():
+            if (
+                self.reuse_graph
+                and not self.training
+                and not torch.compiler.is_compiling()
+            ):
+                corresponding_edges_cache = self._corresponding_edges_cache
+
+        # The bucketed NEF width is tracked with Python integers, which are symbolic
+        # under ``torch.compile``, so bucketing is only done in eager and TorchScript.
+        bucket_nef_width = self.bucket_nef_width
+        if not torch.jit.is_scripting():
+            if torch.compiler.is_compiling():
+                bucket_nef_width = False
+
         (
             element_indices_nodes,
             element_indices_neighbors,
@@ -304,7 +382,12 @@ class PETBackend(torch.nn.Module):
             self.adaptive_cutoff_method,
             cutoff_width_adaptive,
             self.nl_is_strict,
+            corresponding_edges_cache,
+            self._nef_width_bucket if bucket_nef_width else 0,
+            bucket_nef_width,
         )
+        if bucket_nef_width:
+            self._nef_width_bucket = max(self._nef_width_bucket, padding_mask.shape[1])
 
         batch_data: Dict[str, torch.Tensor] = {
             "element_indices_nodes": element_indices_nodes,
@@ -364,15 +447,20 @@ class PETBackend(torch.nn.Module):
             batch_data["edge_vectors"].requires_grad and self.training
         )
 
-        if self.featurizer_type == "feedforward":
-            node_features_list, edge_features_list = (
-                self._feedforward_featurization_impl(
-                    featurizer_inputs, use_manual_attention
-                )
+        autocast_dtype: Optional[torch.dtype] = None
+        if not torch.jit.is_scripting():
+            autocast_dtype = self.autocast_dtype
+
+        if autocast_dtype is None:
+            node_features_list, edge_features_list = self._featurize(
+                featurizer_inputs, use_manual_attention, capture_diagnostics
             )
         else:
-            node_features_list, edge_features_list = self._residual_featurization_impl(
-                featurizer_inputs, use_manual_attention
+            node_features_list, edge_features_list = self._featurize_autocast(
+                featurizer_inputs,
+                use_manual_attention,
+                capture_diagnostics,
+                autocast_dtype,
             )
 
         # ===== BEGIN DIAGNOSTIC-RELATED BLOCK
@@ -398,6 +486,119 @@ class PETBackend(torch.nn.Module):
 
         return node_features_list, edge_features_list
 
+    def _featurize(
+        self,
+        inputs: Dict[str, torch.Tensor],
+        use_manual_attention: bool,
+        capture_diagnostics: bool,
+    ) -> Tuple[List[torch.Tensor], List[torch.Tensor]]:
+        """
+        Dispatch to the featurization strategy selected by ``featurizer_type``.
+
+        :param inputs: Dictionary containing input tensors required for feature
+            computation.
+        :param use_manual_attention: Whether to use manual attention computation
+            (required for double backward when edge vectors require gradients).
+        :param capture_diagnostics: Whether diagnostic hooks are active.
+        :return: Tuple of two lists, the node and edge feature tensors.
+        """
+        if self.featurizer_type == "feedforward":
+            return self._feedforward_featurization_impl(inputs, use_manual_attention)
+        else:
+            return self._residual_featurization_impl(
+                inputs, use_manual_attention, capture_diagnostics
+            )
+
+    @torch.jit.unused
+    def compile_calculate_features(self, mode: str = "reduce-overhead") -> None:
+        """
+        Replace :meth:`calculate_features` on this instance by a ``torch.compile``-d
+        version with static shapes.
+
+        With the default ``mode="reduce-overhead"``, the compiled featurizer is
+        replayed as a CUDA graph, which removes the per-kernel launch overhead that
+        dominates the evaluation of small systems (e.g. in molecular dynamics). For
+        this, the shapes of the NEF arrays must be stable between calls, so this also
+        enables :attr:`bucket_nef_width`. A new graph is then only compiled when the
+        number of atoms changes or when the NEF width grows to the next bucket.
+
+        If the backend compiler fails on the first call, a warning is emitted and the
+        eager :meth:`calculate_features` is used from then on. Any other error is
+        raised as usual (code that dynamo does not support only causes graph breaks,
+        since the featurizer is not compiled with ``fullgraph=True``). When diagnostic
+        outputs are requested, the eager version is always used, since hooks are not
+        supported in compiled code.
+
+        This is meant for evaluation from Python: the compiled featurizer is an
+        instance attribute, which cannot be exported with TorchScript, so it is removed
+        by :meth:`metatrain.pet.PET.export`. Use ``del backend.calculate_features`` to
+        go back to the eager version.
+
+        :param mode: The ``torch.compile`` mode.
+        """
+        eager_calculate_features = self.calculate_features
+        compiled_calculate_features = torch.compile(
+            eager_calculate_features, mode=mode, dynamic=False
+        )
+        # ``None`` until the first call, then whether the compiled version works
+        use_compiled: List[Optional[bool]] = [None]
+
+        def calculate_features(
+            batch_data: Dict[str, torch.Tensor], capture_diagnostics: bool = False
+        ) -> Tuple[List[torch.Tensor], List[torch.Tensor]]:
+            if capture_diagnostics or use_compiled[0] is False:
+                return eager_calculate_features(batch_data, capture_diagnostics)
+
+            if use_compiled[0] is None:
+                try:
+                    features = compiled_calculate_features(batch_data)
+                except torch._dynamo.exc.BackendCompilerFailed as e:
+                    warnings.warn(
+                        "compilation of the PET featurizer failed, falling back to "
+                        f"eager execution: {e}",
+                        stacklevel=2,
+                    )
+                    use_compiled[0] = False
+                    return eager_calculate_features(batch_data)
+                use_compiled[0] = True
+                return features
+
+            return compiled_calculate_features(batch_data)
+
+        self.bucket_nef_width = True
+        self.calculate_features = calculate_features  # type: ignore[method-assign]
+
+    @torch.jit.unused
+    def _featurize_autocast(
+        self,
+        inputs: Dict[str, torch.Tensor],
+        use_manual_attention: bool,
+        capture_diagnostics: bool,
+        autocast_dtype: torch.dtype,
+    ) -> Tuple[List[torch.Tensor], List[torch.Tensor]]:
+        """
+        Run :meth:`_featurize` under ``torch.autocast`` with ``autocast_dtype``, and
+        cast the resulting features back to the dtype of the edge vectors.
+
+        :param inputs: Dictionary containing input tensors required for feature
+            computation.
+        :param use_manual_attention: Whether to use manual attention computation.
+        :param capture_diagnostics: Whether diagnostic hooks are active.
+        :param autocast_dtype: The reduced-precision dtype used by autocast.
+        :return: Tuple of two lists, the node and edge feature tensors.
+        """
+        dtype = inputs["edge_vectors"].dtype
+        with torch.autocast(
+            device_type=inputs["edge_vectors"].device.type, dtype=autocast_dtype
+        ):
+            node_features_list, edge_features_list = self._featurize(
+                inputs, use_manual_attention, capture_diagnostics
+            )
+        return (
+            [features.to(dtype) for features in node_features_list],
+            [features.to(dtype) for features in edge_features_list],
+        )
+
     def predict(
         self,
         node_features_list: List[torch.Tensor],
@@ -406,6 +607,7 @@ class PETBackend(torch.nn.Module):
         cells: torch.Tensor,
         system_indices: torch.Tensor,
         requested_output_names: List[str],
+        capture_diagnostics: bool = False,
     ) -> Tuple[
         Dict[str, List[torch.Tensor]],
         Dict[str, List[torch.Tensor]],
@@ -423,6 +625,8 @@ class PETBackend(torch.nn.Module):
             normalize non-conservative stress predictions by cell volume.
         :param system_indices: System index for each atom, shape ``(num_nodes,)``.
         :param requested_output_names: Names of the target outputs to compute.
+        :param capture_diagnostics: Whether diagnostic hooks might be registered on
+            the last layers, see :meth:`_calculate_atomic_predictions`.
         :return: A tuple ``(atomic_predictions, node_ll_features, edge_ll_features)``
             where ``atomic_predictions`` maps each requested output to a list of
             per-block flat prediction tensors, and the last-layer feature dictionaries
@@ -443,6 +647,7 @@ class PETBackend(torch.nn.Module):
                 padding_mask,
                 cutoff_factors,
                 requested_output_names,
+                capture_diagnostics,
             )
         )
 
@@ -537,23 +742,18 @@ class PETBackend(torch.nn.Module):
             # from atom `j` to atom `i` in on the GNN layer N+1 is a
             # reversed message from atom `i` to atom `j` on the GNN layer N.
             input_node_embeddings = output_node_embeddings
-            new_input_edge_embeddings = output_edge_embeddings.reshape(
-                output_edge_embeddings.shape[0] * output_edge_embeddings.shape[1],
-                output_edge_embeddings.shape[2],
-            )[inputs["reverse_neighbor_index"]].reshape(
-                output_edge_embeddings.shape[0],
-                output_edge_embeddings.shape[1],
-                output_edge_embeddings.shape[2],
+            new_input_edge_embeddings = reverse_nef_array(
+                output_edge_embeddings, inputs["reverse_neighbor_index"]
             )
             # input_messages = 0.5 * (output_edge_embeddings + new_input_messages)
             concatenated = torch.cat(
                 [output_edge_embeddings, new_input_edge_embeddings], dim=-1
             )
-            input_edge_embeddings = (
-                input_edge_embeddings
-                + output_edge_embeddings
-                + combination_mlp(combination_norm(concatenated))
-            )
+            # the second sum is done in-place on the (fresh) first one, which is
+            # safe for autograd and saves one edge-sized allocation per layer
+            input_edge_embeddings = torch.add(
+                input_edge_embeddings, output_edge_embeddings
+            ).add_(combination_mlp(combination_norm(concatenated)))
 
             # ===== BEGIN DIAGNOSTIC-RELATED ATTRIBUTES
             # Capture the node and edge features from this GNN layer post message
@@ -568,7 +768,10 @@ class PETBackend(torch.nn.Module):
         return node_features_list, edge_features_list
 
     def _residual_featurization_impl(
-        self, inputs: Dict[str, torch.Tensor], use_manual_attention: bool
+        self,
+        inputs: Dict[str, torch.Tensor],
+        use_manual_attention: bool,
+        capture_diagnostics: bool = False,
     ) -> Tuple[List[torch.Tensor], List[torch.Tensor]]:
         """
         Residual featurization: saves intermediate features from each GNN layer
@@ -578,6 +781,8 @@ class PETBackend(torch.nn.Module):
             computation
         :param use_manual_attention: Whether to use manual attention computation
             (required for double backward when edge vectors require gradients)
+        :param capture_diagnostics: Whether diagnostic hooks might be registered on
+            the node embedders, see :meth:`_embed_nodes`.
         :return: Tuple of two lists:
             - List of node feature tensors from all GNN layers
             - List of edge feature tensors from all GNN layers
@@ -593,10 +798,11 @@ class PETBackend(torch.nn.Module):
                 inputs["spin_multiplicity"],
                 inputs["system_indices"],
             )
-        for node_embedder, gnn_layer in zip(
-            self.node_embedders, self.gnn_layers, strict=True
-        ):
-            input_node_embeddings = node_embedder(inputs["element_indices_nodes"])
+        node_embeddings = self._embed_nodes(
+            inputs["element_indices_nodes"], capture_diagnostics
+        )
+        for i, gnn_layer in enumerate(self.gnn_layers):
+            input_node_embeddings = node_embeddings[i]
             output_node_embeddings, output_edge_embeddings = gnn_layer(
                 input_node_embeddings,
                 input_edge_embeddings,
@@ -617,18 +823,53 @@ class PETBackend(torch.nn.Module):
             # using a reversed neighbor list, so the new input message
             # from atom `j` to atom `i` in on the GNN layer N+1 is a
             # reversed message from atom `i` to atom `j` on the GNN layer N.
-            # (Flatten, index, and reshape to the original shape)
-            new_input_messages = output_edge_embeddings.reshape(
-                output_edge_embeddings.shape[0] * output_edge_embeddings.shape[1],
-                output_edge_embeddings.shape[2],
-            )[inputs["reverse_neighbor_index"]].reshape(
-                output_edge_embeddings.shape[0],
-                output_edge_embeddings.shape[1],
-                output_edge_embeddings.shape[2],
+            new_input_messages = reverse_nef_array(
+                output_edge_embeddings, inputs["reverse_neighbor_index"]
             )
-            input_edge_embeddings = 0.5 * (input_edge_embeddings + new_input_messages)
+            # the scaling is done in-place on the (fresh) sum, which is safe for
+            # autograd and saves one edge-sized allocation per layer
+            input_edge_embeddings = torch.add(
+                input_edge_embeddings, new_input_messages
+            ).mul_(0.5)
         return node_features_list, edge_features_list
 
+    def _embed_nodes(
+        self, element_indices_nodes: torch.Tensor, capture_diagnostics: bool
+    ) -> List[torch.Tensor]:
+        """
+        Compute the input node embeddings of all the readout layers.
+
+        All node embedders have the same shape and are applied to the same species
+        indices, so their tables are concatenated and looked up at once, instead of
+        launching one embedding kernel per GNN layer. The embedders are called one by
+        one only when diagnostic hooks (which need the modules to actually be called)
+        might be registered on them.
+
+        :param element_indices_nodes: The species indices of the nodes.
+        :param capture_diagnostics: Whether diagnostic hooks might be registered.
+        :return: List of node embeddings, one per readout layer, each of shape
+            ``(n_nodes, d_node)``.
+        """
+        node_embeddings: List[torch.Tensor] = []
+        if (
+            capture_diagnostics
+            and (not torch.jit.is_scripting())
+            and (not torch.jit.is_tracing())
+        ):
+            for node_embedder in self.node_embedders:
+                node_embeddings.append(node_embedder(element_indices_nodes))
+            return node_embeddings
+
+        weights: List[torch.Tensor] = []
+        for node_embedder in self.node_embedders:
+            weights.append(node_embedder.weight)
+        all_node_embeddings = torch.nn.functional.embedding(
+            element_indices_nodes, torch.cat(weights, dim=1)
+        )
+        for embeddings in torch.split(all_node_embeddings, self.d_node, dim=1):
+            node_embeddings.append(embeddings)
+        return node_embeddings
+
     def _calculate_last_layer_features(
         self,
         node_features_list: List[torch.Tensor],
@@ -674,6 +915,7 @@ class PETBackend(torch.nn.Module):
         padding_mask: torch.Tensor,
         cutoff_factors: torch.Tensor,
         requested_output_names: List[str],
+        capture_diagnostics: bool = False,
     ) -> Tuple[
         Dict[str, List[List[torch.Tensor]]], Dict[str, List[List[torch.Tensor]]]
     ]:
@@ -691,6 +933,8 @@ class PETBackend(torch.nn.Module):
         :param cutoff_factors: Tensor of cutoff factors for edge distances
             [n_atoms, max_num_neighbors].
         :param requested_output_names: Names of the target outputs to compute.
+        :param capture_diagnostics: Whether diagnostic hooks might be registered on
+            the last layers, in which case they are applied block by block.
         :return: Tuple of two dictionaries:
             - Dictionary mapping output names to lists of lists of node atomic
               prediction tensors (one list per GNN layer, one tensor per block)
@@ -700,6 +944,19 @@ class PETBackend(torch.nn.Module):
         node_atomic_predictions_dict: Dict[str, List[List[torch.Tensor]]] = {}
         edge_atomic_predictions_dict: Dict[str, List[List[torch.Tensor]]] = {}
 
+        # The last layers of the different blocks of an output all act on the same
+        # last layer features, so their weights are concatenated and applied with a
+        # single matrix multiplication, whose result is then split by block. The last
+        # layers are called one by one only when diagnostic hooks (which need the
+        # modules to actually be called) might be registered on them.
+        fuse_blocks = True
+        if (
+            capture_diagnostics
+            and (not torch.jit.is_scripting())
+            and (not torch.jit.is_tracing())
+        ):
+            fuse_blocks = False
+
         # Computing node atomic predictions. Since we have last layer features
         # for each GNN layer, and each last layer can have multiple blocks,
         # we apply each last layer block to each of the last layer features.
@@ -714,10 +971,31 @@ class PETBackend(torch.nn.Module):
                         output_name
                     ][i]
                     node_atomic_predictions_by_block: List[torch.Tensor] = []
-                    for node_last_layer_by_block in node_last_layer.values():
-                        node_atomic_predictions_by_block.append(
-                            node_last_layer_by_block(node_last_layer_features)
+                    node_weights: List[torch.Tensor] = []
+                    node_biases: List[torch.Tensor] = []
+                    node_block_sizes: List[int] = []
+                    if fuse_blocks:
+                        for node_last_layer_by_block in node_last_layer.values():
+                            node_weights.append(node_last_layer_by_block.weight)
+                            node_biases.append(node_last_layer_by_block.bias)
+                            node_block_sizes.append(
+                                node_last_layer_by_block.weight.shape[0]
+                            )
+                    if len(node_weights) > 1:
+                        node_atomic_predictions = torch.nn.functional.linear(
+                            node_last_layer_features,
+                            torch.cat(node_weights),
+                            torch.cat(node_biases),
                         )
+                        for predictions in torch.split(
+                            node_atomic_predictions, node_block_sizes, dim=-1
+                        ):
+                            node_atomic_predictions_by_block.append(predictions)
+                    else:
+                        for node_last_layer_by_block in node_last_layer.values():
+                            node_atomic_predictions_by_block.append(
+                                node_last_layer_by_block(node_last_layer_features)
+                            )
                     node_atomic_predictions_dict[output_name].append(
                         node_atomic_predictions_by_block
                     )
@@ -725,6 +1003,8 @@ class PETBackend(torch.nn.Module):
         # Computing edge atomic predictions. Following the same logic as above,
         # we (1) iterate over the last layer features and last layer blocks, and (2)
         # sum the edge features with cutoff factors to get their per-node contribution.
+        # When the blocks are fused, the masking and the weighted sum over neighbors
+        # are also done once for all blocks.
 
         for output_name, edge_last_layers in self.edge_last_layers.items():
             if output_name in requested_output_names:
@@ -736,21 +1016,38 @@ class PETBackend(torch.nn.Module):
                         output_name
                     ][i]
                     edge_atomic_predictions_by_block: List[torch.Tensor] = []
-                    for edge_last_layer_by_block in edge_last_layer.values():
-                        edge_atomic_predictions = edge_last_layer_by_block(
-                            edge_last_layer_features
-                        )
-                        expanded_padding_mask = padding_mask[..., None].repeat(
-                            1, 1, edge_atomic_predictions.shape[2]
+                    edge_weights: List[torch.Tensor] = []
+                    edge_biases: List[torch.Tensor] = []
+                    edge_block_sizes: List[int] = []
+                    if fuse_blocks:
+                        for edge_last_layer_by_block in edge_last_layer.values():
+                            edge_weights.append(edge_last_layer_by_block.weight)
+                            edge_biases.append(edge_last_layer_by_block.bias)
+                            edge_block_sizes.append(
+                                edge_last_layer_by_block.weight.shape[0]
+                            )
+                    if len(edge_weights) > 1:
+                        edge_atomic_predictions = torch.nn.functional.linear(
+                            edge_last_layer_features,
+                            torch.cat(edge_weights),
+                            torch.cat(edge_biases),
                         )
-                        edge_atomic_predictions = torch.where(
-                            ~expanded_padding_mask, 0.0, edge_atomic_predictions
+                        edge_atomic_predictions = _sum_edge_predictions(
+                            edge_atomic_predictions, padding_mask, cutoff_factors
                         )
-                        edge_atomic_predictions_by_block.append(
-                            (edge_atomic_predictions * cutoff_factors[:, :, None]).sum(
-                                dim=1
+                        for predictions in torch.split(
+                            edge_atomic_predictions, edge_block_sizes, dim=-1
+                        ):
+                            edge_atomic_predictions_by_block.append(predictions)
+                    else:
+                        for edge_last_layer_by_block in edge_last_layer.values():
+                            edge_atomic_predictions_by_block.append(
+                                _sum_edge_predictions(
+                                    edge_last_layer_by_block(edge_last_layer_features),
+                                    padding_mask,
+                                    cutoff_factors,
+                                )
                             )
-                        )
                     edge_atomic_predictions_dict[output_name].append(
                         edge_atomic_predictions_by_block
                     )
@@ -758,6 +1055,29 @@ class PETBackend(torch.nn.Module):
         return node_atomic_predictions_dict, edge_atomic_predictions_dict
 
 
+def _sum_edge_predictions(
+    edge_atomic_predictions: torch.Tensor,
+    padding_mask: torch.Tensor,
+    cutoff_factors: torch.Tensor,
+) -> torch.Tensor:
+    """
+    Sum per-edge predictions over the neighbors of each atom, weighted by the cutoff
+    factors, ignoring the padded edges.
+
+    :param edge_atomic_predictions: Per-edge predictions in NEF layout, of shape
+        [n_atoms, max_num_neighbors, n_features].
+    :param padding_mask: Boolean mask indicating real vs padded neighbors
+        [n_atoms, max_num_neighbors].
+    :param cutoff_factors: Tensor of cutoff factors for edge distances
+        [n_atoms, max_num_neighbors].
+    :return: Per-atom predictions of shape [n_atoms, n_features].
+    """
+    edge_atomic_predictions = torch.where(
+        padding_mask[..., None], edge_atomic_predictions, 0.0
+    )
+    return (edge_atomic_predictions * cutoff_factors[:, :, None]).sum(dim=1)
+
+
 def process_non_conservative_stress(
     tensor: torch.Tensor,
     cells: torch.Tensor,
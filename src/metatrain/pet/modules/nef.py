@@ -13,7 +13,7 @@ edge arrays with shape (n_edges, ...) and NEF arrays with shape
 (n_nodes, n_edges_per_node, ...).
 """
 
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
 import torch
 
@@ -157,11 +157,76 @@ def get_corresponding_edges(
         + neg_cs_norm[:, 2]
     )
 
-    unique_id_argsort = unique_id.argsort()
-    unique_id_inverse_argsort = unique_id_inverse.argsort()
+    # The corresponding edge of each edge is the one whose id is the inverse id of the
+    # edge. The ids are sorted once, and the inverse ids are looked up in the sorted
+    # ids with a binary search, which is cheaper than sorting the inverse ids as well.
+    # The positions are clamped so that an edge without a corresponding edge still
+    # gets a valid index, but this index points to an arbitrary edge. The result is
+    # therefore only a permutation of the edges (and an involution) for symmetric
+    # neighbor lists, where every ``i -> j`` edge comes with its ``j -> i`` edge, as
+    # is the case for the full neighbor lists used by PET.
+    sorted_unique_id, unique_id_argsort = torch.sort(unique_id)
+    positions = torch.searchsorted(sorted_unique_id, unique_id_inverse)
+    positions = positions.clamp(max=unique_id.shape[0] - 1)
+    corresponding_edges = unique_id_argsort.index_select(0, positions)
 
-    corresponding_edges = torch.empty_like(centers)
-    corresponding_edges[unique_id_argsort] = unique_id_inverse_argsort
+    return corresponding_edges
+
+
+def get_corresponding_edges_cached(
+    centers: torch.Tensor,
+    neighbors: torch.Tensor,
+    cell_shifts: torch.Tensor,
+    cache: List[torch.Tensor],
+) -> torch.Tensor:
+    """
+    Same as ``get_corresponding_edges``, but reuses the result of the previous call
+    when it was made with exactly the same edges.
+
+    This is useful when the same neighbor list is evaluated many times in a row (for
+    example during molecular dynamics, where the topology of the neighbor list rarely
+    changes between steps), since checking the edges for equality is much cheaper than
+    the sort and binary search of ``get_corresponding_edges``. The edges are packed in
+    a single tensor, so that this check only needs one comparison (and one
+    synchronization with the device).
+
+    The cache is updated in place, so it must not be shared between concurrent calls.
+
+    :param centers: A 1D tensor of shape (n_edges,) containing, for each
+        ``i -> j`` edge, the index of the center node ``i``.
+    :param neighbors: A 1D tensor of shape (n_edges,) containing, for each
+        ``i -> j`` edge, the index of the neighbor node ``j``.
+    :param cell_shifts: A 2D tensor of shape (n_edges, 3) with the cell shifts
+        along x, y, z for each edge.
+    :param cache: Either an empty list, or the list ``[edges, corresponding_edges]``
+        filled by a previous call to this function, where ``edges`` packs the centers,
+        neighbors and cell shifts of the edges. It is updated in place when the edges
+        changed.
+
+    :return: A 1D tensor of shape (n_edges,) containing, for each edge,
+        the index of the corresponding edge, as ``get_corresponding_edges``.
+    """
+    edges = torch.cat(
+        [
+            centers.to(torch.int64).unsqueeze(1),
+            neighbors.to(torch.int64).unsqueeze(1),
+            cell_shifts.to(torch.int64),
+        ],
+        dim=1,
+    )
+    if len(cache) == 2:
+        if (
+            cache[0].device == edges.device
+            and cache[0].shape == edges.shape
+            and torch.equal(cache[0], edges)
+        ):
+            return cache[1]
+
+    corresponding_edges = get_corresponding_edges(centers, neighbors, cell_shifts)
+
+    cache.clear()
+    cache.append(edges)
+    cache.append(corresponding_edges)
 
     return corresponding_edges
 
@@ -218,6 +283,41 @@ def nef_array_to_edges(
     return nef_array[centers, nef_to_edges_neighbor]
 
 
+def reverse_nef_array(
+    nef_array: torch.Tensor, reverse_neighbor_index: torch.Tensor
+) -> torch.Tensor:
+    """Reorders a NEF array so that the entry of each ``i -> j`` edge holds the value
+    of the reversed ``j -> i`` edge.
+
+    The NEF array is flattened over its first two dimensions (a view), gathered with
+    ``index_select`` and reshaped back. Compared to advanced indexing, the backward of
+    ``index_select`` is a plain ``index_add``: when ``reverse_neighbor_index`` is a
+    permutation of the flattened NEF grid, this avoids the sort that the accumulating
+    ``index_put`` used by the backward of advanced indexing needs to deal with
+    repeated indices.
+
+    :param nef_array: A tensor in NEF layout, with shape
+        (n_nodes, n_edges_per_node, n_features).
+    :param reverse_neighbor_index: The flat index of the reversed edge for each entry
+        of the NEF grid, with shape (n_nodes, n_edges_per_node). This should be a
+        permutation of the flattened NEF grid. ``compute_batch_tensors`` ensures this
+        for symmetric neighbor lists, by making the padded entries point to
+        themselves. With non-symmetric neighbor lists, the values are still gathered
+        correctly, but the backward pass accumulates gradients for repeated indices.
+
+    :return: A tensor with the same shape as ``nef_array``, containing the values of
+        the reversed edges.
+    """
+    n_nodes = nef_array.shape[0]
+    n_edges_per_node = nef_array.shape[1]
+    n_features = nef_array.shape[2]
+    flat_nef_array = nef_array.reshape(n_nodes * n_edges_per_node, n_features)
+    reversed_flat_nef_array = flat_nef_array.index_select(
+        0, reverse_neighbor_index.reshape(-1)
+    )
+    return reversed_flat_nef_array.reshape(n_nodes, n_edges_per_node, n_features)
+
+
 def compute_reversed_neighbor_list(
     nef_indices: torch.Tensor,
     corresponding_edges: torch.Tensor,
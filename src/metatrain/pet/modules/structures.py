@@ -9,6 +9,7 @@ from .nef import (
     compute_reversed_neighbor_list,
     edge_array_to_nef,
     get_corresponding_edges,
+    get_corresponding_edges_cached,
     get_nef_indices,
 )
 from .utilities import cutoff_func_bump, cutoff_func_cosine
@@ -97,7 +98,6 @@ def concatenate_structures(
     nl_values_list: List[torch.Tensor] = []
     sizes: List[int] = []
     num_edges: List[int] = []
-    node_offsets_list: List[int] = []
 
     node_counter = 0
     for system in systems:
@@ -111,7 +111,6 @@ def concatenate_structures(
         nl_values_list.append(nl_values)
 
         system_size = len(system)
-        node_offsets_list.append(node_counter)
         sizes.append(system_size)
         num_edges.append(nl_values.shape[0])
         node_counter += system_size
@@ -125,11 +124,20 @@ def concatenate_structures(
     neighbors = nl_values[:, 1]
     cell_shifts = nl_values[:, 2:]
 
-    num_systems = len(systems)
     total_edges = sum(num_edges)
-    sizes_tensor = torch.tensor(sizes, device=device, dtype=torch.long)
-    num_edges_tensor = torch.tensor(num_edges, device=device, dtype=torch.long)
-    node_offsets = torch.tensor(node_offsets_list, device=device, dtype=torch.long)
+    # the per-system counts are sent to the device with a single host-to-device copy,
+    # and everything else is derived from them on the device. On CUDA, the counts are
+    # staged in pinned memory so that the copy is asynchronous and overlaps with the
+    # concatenations above. Pinned blocks come from PyTorch's caching host allocator,
+    # which reuses them across calls and does not hand them out again while a copy
+    # from them is still in flight.
+    counts = torch.tensor([sizes, num_edges], dtype=torch.long)
+    if device.type == "cuda":
+        counts = counts.pin_memory()
+    counts = counts.to(device, non_blocking=True)
+    sizes_tensor = counts[0]
+    num_edges_tensor = counts[1]
+    node_offsets = torch.cumsum(sizes_tensor, dim=0) - sizes_tensor
 
     edge_offsets = torch.repeat_interleave(
         node_offsets, num_edges_tensor, output_size=total_edges
@@ -137,16 +145,16 @@ def concatenate_structures(
     centers = centers + edge_offsets
     neighbors = neighbors + edge_offsets
 
-    system_indices = torch.repeat_interleave(
-        torch.arange(num_systems, device=device),
-        sizes_tensor,
-        output_size=node_counter,
+    system_indices, atom_indices = _batch_indices(
+        sizes_tensor, node_offsets, node_counter
     )
-    atom_indices = torch.arange(
-        node_counter, device=device, dtype=torch.long
-    ) - torch.repeat_interleave(node_offsets, sizes_tensor, output_size=node_counter)
 
-    sample_values = torch.stack([system_indices, atom_indices], dim=1)
+    # ``Labels`` store their values as ``int32``, so the two columns are written
+    # directly into an ``int32`` array, instead of stacking them as ``int64`` and
+    # letting ``Labels`` convert the result.
+    sample_values = torch.empty((node_counter, 2), dtype=torch.int32, device=device)
+    sample_values[:, 0] = system_indices
+    sample_values[:, 1] = atom_indices
     sample_labels = Labels(
         names=["system", "atom"],
         values=sample_values,
@@ -165,6 +173,83 @@ def concatenate_structures(
     )
 
 
+def _batch_indices(
+    sizes: torch.Tensor, node_offsets: torch.Tensor, num_nodes: int
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Compute the system index and the index within its system of every atom in a batch.
+
+    Only ``arange``, ``repeat_interleave`` and a gather are used, so that the number of
+    kernels does not depend on the number of systems in the batch.
+
+    :param sizes: Number of atoms in each system, shape ``(num_systems,)``.
+    :param node_offsets: Index of the first atom of each system in the batch, i.e. the
+        exclusive cumulative sum of ``sizes``, shape ``(num_systems,)``.
+    :param num_nodes: Total number of atoms in the batch (``sizes.sum()``), passed
+        explicitly to avoid a device-to-host synchronization.
+    :return: A tuple ``(system_indices, atom_indices)``, both of shape
+        ``(num_nodes,)``.
+    """
+    system_indices = torch.repeat_interleave(
+        torch.arange(sizes.shape[0], device=sizes.device),
+        sizes,
+        output_size=num_nodes,
+    )
+    atom_indices = (
+        torch.arange(num_nodes, device=sizes.device, dtype=torch.long)
+        - node_offsets[system_indices]
+    )
+    return system_indices, atom_indices
+
+
+def _next_power_of_two(n: int) -> int:
+    """
+    Smallest power of two larger or equal to ``n``.
+
+    :param n: A non-negative integer.
+    :return: The smallest power of two ``>= n`` (and ``1`` for ``n = 0``).
+    """
+    power = 1
+    while power < n:
+        power *= 2
+    return power
+
+
+def edge_geometry_to_nef(
+    edge_vectors: torch.Tensor,
+    cutoff_factors: torch.Tensor,
+    nef_indices: torch.Tensor,
+    nef_mask: torch.Tensor,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    Convert the per-edge geometric inputs of PET to NEF layout.
+
+    The edge vectors and the cutoff factors are gathered into the NEF grid with a
+    single indexing operation (instead of one per array), which halves the number of
+    gather kernels in the forward pass and, more importantly, the number of
+    ``index_put`` (sort + accumulate) kernels in the backward pass. The edge distances
+    are then recomputed from the NEF edge vectors.
+
+    :param edge_vectors: Cartesian edge vectors, shape ``(n_edges, 3)``.
+    :param cutoff_factors: Cutoff function values for each edge, shape ``(n_edges,)``.
+    :param nef_indices: The indices to convert from edge to NEF layout, as returned by
+        :func:`get_nef_indices`.
+    :param nef_mask: The NEF padding mask, as returned by :func:`get_nef_indices`.
+    :return: A tuple ``(edge_vectors, edge_distances, cutoff_factors)`` in NEF layout,
+        with shapes ``(n_nodes, max_edges_per_node, 3)``, ``(n_nodes,
+        max_edges_per_node)`` and ``(n_nodes, max_edges_per_node)`` respectively. The
+        cutoff factors of the padded edges are set to zero.
+    """
+    edge_data = torch.cat([edge_vectors, cutoff_factors[:, None]], dim=1)
+    nef_edge_data = edge_array_to_nef(edge_data, nef_indices)
+
+    nef_edge_vectors = nef_edge_data[:, :, :3]
+    nef_edge_distances = torch.sqrt(torch.sum(nef_edge_vectors**2, dim=2) + 1e-15)
+    nef_cutoff_factors = torch.where(nef_mask, nef_edge_data[:, :, 3], 0.0)
+
+    return nef_edge_vectors, nef_edge_distances, nef_cutoff_factors
+
+
 def compute_batch_tensors(
     positions: torch.Tensor,
     centers: torch.Tensor,
@@ -181,6 +266,9 @@ def compute_batch_tensors(
     adaptive_cutoff_method: str = "solver",
     cutoff_width_adaptive: float = 1.0,
     nl_is_strict: bool = True,
+    corresponding_edges_cache: Optional[List[torch.Tensor]] = None,
+    min_edges_per_node: int = 0,
+    pad_edges_per_node_to_power_of_two: bool = False,
 ) -> Tuple[
     torch.Tensor,
     torch.Tensor,
@@ -229,6 +317,16 @@ def compute_batch_tensors(
     :param nl_is_strict: Whether the neighbor list only contains pairs within the
         cutoff. If ``False``, the extra pairs are filtered out here. Only used with a
         fixed cutoff, since the adaptive cutoff filters the edges anyway.
+    :param corresponding_edges_cache: Optional cache for the corresponding edges, see
+        :func:`get_corresponding_edges_cached`. If ``None``, the corresponding edges
+        are always recomputed.
+    :param min_edges_per_node: Minimal size of the second dimension of the NEF
+        arrays. Nodes are padded up to this number of edges even if no node has as
+        many neighbors.
+    :param pad_edges_per_node_to_power_of_two: Whether to round the size of the second
+        dimension of the NEF arrays up to the next power of two. Together with
+        ``min_edges_per_node``, this keeps the shapes of the NEF arrays constant over
+        successive batches with similar (but not identical) neighbor counts.
     :return: A tuple containing the batch tensors.
         The batch consists of the following tensors:
         - `element_indices_nodes`: The atomic species of the central atoms
@@ -265,11 +363,9 @@ def compute_batch_tensors(
     if len(cells) == 1:
         cell_contributions = cell_shifts.to(cells.dtype) @ cells[0]
     else:
-        cell_contributions = torch.einsum(
-            "ab, abc -> ac",
-            cell_shifts.to(cells.dtype),
-            cells[system_indices[centers]],
-        )
+        cell_contributions = (
+            cell_shifts.to(cells.dtype).unsqueeze(-2) @ cells[system_indices[centers]]
+        ).squeeze(-2)
     edge_vectors = positions[neighbors] - positions[centers] + cell_contributions
     edge_distances = torch.norm(edge_vectors, dim=-1) + 1e-15
 
@@ -324,11 +420,16 @@ def compute_batch_tensors(
                 cell_shifts = cell_shifts.index_select(0, keep)
                 edge_distances = edge_distances.index_select(0, keep)
 
-        pair_cutoffs = cutoff * torch.ones(
-            len(centers), device=positions.device, dtype=positions.dtype
+        # With a fixed cutoff, all the pairs share the same cutoff, which is passed to
+        # the cutoff function as a scalar tensor and broadcast against the distances,
+        # instead of materializing (and then subtracting the width from) one cutoff
+        # per edge. ``torch.full`` launches a fill kernel, while ``torch.tensor`` would
+        # copy the value from the host (and synchronize) on every call.
+        pair_cutoffs = torch.full(
+            (), cutoff, device=positions.device, dtype=positions.dtype
         )
-        atomic_cutoffs_stats = cutoff * torch.ones(
-            num_nodes, device=positions.device, dtype=positions.dtype
+        atomic_cutoffs_stats = torch.full(
+            (num_nodes,), cutoff, device=positions.device, dtype=positions.dtype
         )
 
     # ``torch.bincount`` has a data-dependent output shape, which becomes an
@@ -356,6 +457,19 @@ def compute_batch_tensors(
     if not torch.jit.is_scripting():
         torch._check(max_edges_per_node >= 0)
 
+    # Optional padding of the NEF grid to a bucketed width. The extra slots are masked
+    # out like any other padding, so this only changes the shapes (and not the values)
+    # of the outputs. These are plain Python integer operations, so this must not be
+    # used under ``torch.compile``, where ``max_edges_per_node`` is symbolic. Batches
+    # without any edge are never padded, since there is no edge to gather the padding
+    # from.
+    if min_edges_per_node > 0 or pad_edges_per_node_to_power_of_two:
+        if max_edges_per_node > 0:
+            if min_edges_per_node > max_edges_per_node:
+                max_edges_per_node = min_edges_per_node
+            if pad_edges_per_node_to_power_of_two:
+                max_edges_per_node = _next_power_of_two(max_edges_per_node)
+
     if cutoff_function.lower() == "bump":
         # use bump switching function for adaptive cutoff
         cutoff_factors = cutoff_func_bump(edge_distances, pair_cutoffs, cutoff_width)
@@ -374,19 +488,25 @@ def compute_batch_tensors(
         centers, num_neighbors, max_edges_per_node
     )
 
-    # Element indices
-    element_indices_nodes = species_to_species_index[species]
-    element_indices_neighbors = element_indices_nodes[neighbors]
-
     # Send everything to NEF:
-    edge_vectors = edge_array_to_nef(edge_vectors, nef_indices)
-    edge_distances = torch.sqrt(torch.sum(edge_vectors**2, dim=2) + 1e-15)
-    element_indices_neighbors = edge_array_to_nef(
-        element_indices_neighbors, nef_indices
+    edge_vectors, edge_distances, cutoff_factors = edge_geometry_to_nef(
+        edge_vectors, cutoff_factors, nef_indices, nef_mask
     )
-    cutoff_factors = edge_array_to_nef(cutoff_factors, nef_indices, nef_mask, 0.0)
+    # The neighbor of each NEF entry is gathered once, and used both to look up the
+    # species indices of the neighbors (directly in NEF layout) and to build the
+    # reversed neighbor index below.
+    nef_neighbors = edge_array_to_nef(neighbors, nef_indices)
 
-    corresponding_edges = get_corresponding_edges(centers, neighbors, cell_shifts)
+    # Element indices
+    element_indices_nodes = species_to_species_index[species]
+    element_indices_neighbors = element_indices_nodes[nef_neighbors]
+
+    if corresponding_edges_cache is None:
+        corresponding_edges = get_corresponding_edges(centers, neighbors, cell_shifts)
+    else:
+        corresponding_edges = get_corresponding_edges_cached(
+            centers, neighbors, cell_shifts, corresponding_edges_cache
+        )
 
     # These are the two arrays we need for message passing with edge reversals,
     # if indexing happens in a two-dimensional way:
@@ -394,7 +514,7 @@ def compute_batch_tensors(
     reversed_neighbor_list = compute_reversed_neighbor_list(
         nef_indices, corresponding_edges, nef_to_edges_neighbor, nef_mask
     )
-    neighbors_index = edge_array_to_nef(neighbors, nef_indices).to(torch.int64)
+    neighbors_index = nef_neighbors.to(torch.int64)
 
     # Here, we compute the array that allows indexing into a flattened
     # version of the edge array (where the first two dimensions are merged):
@@ -404,15 +524,17 @@ def compute_batch_tensors(
     # At this point, we have `reverse_neighbor_index[~nef_mask] = 0`, which however
     # creates too many of the same index which slows down backward enormously.
     # (See see https://github.com/pytorch/pytorch/issues/41162)
-    # We therefore replace the padded indices with a sequence of unique indices.
-    # ``cumsum(~mask) - 1`` gives, at each padded slot, its running position among the
-    # padded slots in flattened (row-major) order — identical to assigning
-    # ``arange(num_padded)`` via a boolean mask, but with static shapes. This avoids a
-    # data-dependent kernel and lets the preprocessing be captured by ``torch.compile``.
+    # We therefore make each padded slot point to itself. Since the real edges are
+    # mapped onto the real edges one-to-one (with a full, symmetric neighbor list, see
+    # ``get_corresponding_edges``), the result is a permutation of the flattened NEF
+    # grid, without any repeated index. This uses static shapes, so that the
+    # preprocessing can be captured by ``torch.compile``.
     flat_mask = nef_mask.reshape(-1)
     flat_reverse = reverse_neighbor_index.reshape(-1)
-    padded_unique = torch.cumsum((~flat_mask).to(torch.long), dim=0) - 1
-    flat_reverse = torch.where(flat_mask, flat_reverse, padded_unique)
+    padded_self = torch.arange(
+        flat_reverse.shape[0], device=flat_reverse.device, dtype=flat_reverse.dtype
+    )
+    flat_reverse = torch.where(flat_mask, flat_reverse, padded_self)
     reverse_neighbor_index = flat_reverse.reshape(reverse_neighbor_index.shape)
 
     return (
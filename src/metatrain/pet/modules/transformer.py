@@ -1,5 +1,5 @@
 import warnings
-from typing import Final, Tuple
+from typing import Final, Optional, Tuple
 
 import torch
 import torch.nn.functional as F
@@ -18,6 +18,27 @@ AVAILABLE_ACTIVATIONS = ["SiLU", "SwiGLU"]
 MAX_CUDA_GRID_DIM: Final[int] = 65535
 
 
+def cutoff_factors_to_attention_bias(
+    cutoff_factors: torch.Tensor, epsilon: float = 1e-15
+) -> torch.Tensor:
+    """
+    Convert cutoff factors into the additive attention bias used by
+    :class:`AttentionBlock`, i.e. their (clamped) logarithm.
+
+    :param cutoff_factors: The cutoff factors for the edges, of shape
+        (batch_size, seq_length, seq_length), or any shape broadcastable to it,
+        such as the (n_nodes, 1, seq_length) factors built by
+        :class:`CartesianTransformer`.
+    :param epsilon: A small value to avoid taking the logarithm of zero.
+    :return: The attention bias, with an additional head dimension of size one
+        inserted at index 1, i.e. of shape (batch_size, 1, seq_length, seq_length)
+        for a full input and (n_nodes, 1, 1, seq_length) for a broadcastable one.
+        In both cases, it broadcasts against attention weights of shape
+        (batch_size, num_heads, seq_length, seq_length).
+    """
+    return torch.log(torch.clamp(cutoff_factors[:, None, :, :], epsilon))
+
+
 class FeedForward(nn.Module):
     def __init__(self, d_model: int, dim_feedforward: int, activation: str) -> None:
         super().__init__()
@@ -84,18 +105,27 @@ class AttentionBlock(nn.Module):
         self._warned_cuda_grid_dim = False
 
     def forward(
-        self, x: torch.Tensor, cutoff_factors: torch.Tensor, use_manual_attention: bool
+        self,
+        x: torch.Tensor,
+        cutoff_factors: torch.Tensor,
+        use_manual_attention: bool,
+        attention_bias: Optional[torch.Tensor] = None,
     ) -> torch.Tensor:
         """
         Forward pass for the attention block.
 
         :param x: The input tensor, of shape (batch_size, seq_length, total_dim)
         :param cutoff_factors: The cutoff factors for the edges, of shape
-            (batch_size, seq_length, seq_length)
+            (batch_size, seq_length, seq_length), or (batch_size, 1, seq_length) if
+            they are the same for all queries.
         :param use_manual_attention: Whether to use the manual attention implementation
             (which supports double backward, needed for training with conservative
             forces), or the built-in PyTorch attention (which does not support double
             backward).
+        :param attention_bias: Optional precomputed attention bias, as returned by
+            :func:`cutoff_factors_to_attention_bias` for ``cutoff_factors``. This
+            allows several attention blocks sharing the same cutoff factors to compute
+            it only once.
         :return: The output tensor, of shape (batch_size, seq_length, total_dim)
         """
         initial_shape = x.shape
@@ -106,8 +136,12 @@ class AttentionBlock(nn.Module):
         x = x.permute(2, 0, 3, 1, 4)
 
         queries, keys, values = x[0], x[1], x[2]
-        attn_weights = torch.clamp(cutoff_factors[:, None, :, :], self.epsilon)
-        attn_weights = torch.log(attn_weights)
+        if attention_bias is None:
+            attn_weights = cutoff_factors_to_attention_bias(
+                cutoff_factors, self.epsilon
+            )
+        else:
+            attn_weights = attention_bias
         scale = 1.0 / (self.head_dim**0.5 * self.temperature)
         if use_manual_attention:
             x = manual_attention(queries, keys, values, attn_weights, self.temperature)
@@ -178,8 +212,15 @@ class TransformerLayer(torch.nn.Module):
         temperature: float = 1.0,
     ) -> None:
         super(TransformerLayer, self).__init__()
+        if transformer_type not in AVAILABLE_TRANSFORMER_TYPES:
+            raise ValueError(
+                f"Unknown transformer flag: {transformer_type}. "
+                f"Please choose from: {AVAILABLE_TRANSFORMER_TYPES}"
+            )
         self.attention = AttentionBlock(d_model, n_heads, temperature)
         self.transformer_type = transformer_type
+        # resolved once here, instead of comparing strings at every forward pass
+        self.is_pre_ln = transformer_type == "PreLN"
         self.d_model = d_model
         norm_class = getattr(nn, norm)
         self.norm_attention = norm_class(d_model)
@@ -206,6 +247,7 @@ class TransformerLayer(torch.nn.Module):
         edge_embeddings: torch.Tensor,
         cutoff_factors: torch.Tensor,
         use_manual_attention: bool,
+        attention_bias: Optional[torch.Tensor],
     ) -> Tuple[torch.Tensor, torch.Tensor]:
         if self.expanded_node_features:
             input_node_embeddings = self.center_contraction(node_embeddings)
@@ -213,7 +255,10 @@ class TransformerLayer(torch.nn.Module):
             input_node_embeddings = node_embeddings
         tokens = torch.cat([input_node_embeddings, edge_embeddings], dim=1)
         new_tokens = self.attention(
-            self.norm_attention(tokens), cutoff_factors, use_manual_attention
+            self.norm_attention(tokens),
+            cutoff_factors,
+            use_manual_attention,
+            attention_bias,
         )
         output_node_embeddings, output_edge_embeddings = torch.split(
             new_tokens, [1, new_tokens.shape[1] - 1], dim=1
@@ -239,6 +284,7 @@ class TransformerLayer(torch.nn.Module):
         edge_embeddings: torch.Tensor,
         cutoff_factors: torch.Tensor,
         use_manual_attention: bool,
+        attention_bias: Optional[torch.Tensor],
     ) -> Tuple[torch.Tensor, torch.Tensor]:
         if self.expanded_node_features:
             input_node_embeddings = self.center_contraction(node_embeddings)
@@ -246,7 +292,10 @@ class TransformerLayer(torch.nn.Module):
             input_node_embeddings = node_embeddings
         tokens = torch.cat([input_node_embeddings, edge_embeddings], dim=1)
         tokens = self.norm_attention(
-            tokens + self.attention(tokens, cutoff_factors, use_manual_attention)
+            tokens
+            + self.attention(
+                tokens, cutoff_factors, use_manual_attention, attention_bias
+            )
         )
         tokens = self.norm_mlp(tokens + self.mlp(tokens))
         output_node_embeddings, output_edge_embeddings = torch.split(
@@ -267,6 +316,7 @@ class TransformerLayer(torch.nn.Module):
         edge_embeddings: torch.Tensor,
         cutoff_factors: torch.Tensor,
         use_manual_attention: bool,
+        attention_bias: Optional[torch.Tensor] = None,
     ) -> Tuple[torch.Tensor, torch.Tensor]:
         """
         Forward pass for a single Transformer layer.
@@ -276,24 +326,34 @@ class TransformerLayer(torch.nn.Module):
         :param edge_embeddings: The input edge embeddings, of shape
             (batch_size, seq_length, d_model)
         :param cutoff_factors: The cutoff factors for the edges, of shape
-            (batch_size, seq_length, seq_length)
+            (batch_size, seq_length, seq_length), or (batch_size, 1, seq_length) if
+            they are the same for all queries.
         :param use_manual_attention: Whether to use the manual attention implementation
             (which supports double backward, needed for training with conservative
             forces), or the built-in PyTorch attention (which does not support double
             backward).
+        :param attention_bias: Optional precomputed attention bias, see
+            :meth:`AttentionBlock.forward`.
         :return: A tuple containing:
             - The output node embeddings, of shape (batch_size, d_model)
             - The output edge embeddings, of shape (batch_size, seq_length, d_model)
         """
-        if self.transformer_type == "PostLN":
-            node_embeddings, edge_embeddings = self._forward_post_ln_impl(
-                node_embeddings, edge_embeddings, cutoff_factors, use_manual_attention
+        if self.is_pre_ln:
+            return self._forward_pre_ln_impl(
+                node_embeddings,
+                edge_embeddings,
+                cutoff_factors,
+                use_manual_attention,
+                attention_bias,
             )
-        if self.transformer_type == "PreLN":
-            node_embeddings, edge_embeddings = self._forward_pre_ln_impl(
-                node_embeddings, edge_embeddings, cutoff_factors, use_manual_attention
+        else:
+            return self._forward_post_ln_impl(
+                node_embeddings,
+                edge_embeddings,
+                cutoff_factors,
+                use_manual_attention,
+                attention_bias,
             )
-        return node_embeddings, edge_embeddings
 
 
 class Transformer(torch.nn.Module):
@@ -376,7 +436,8 @@ class Transformer(torch.nn.Module):
         :param edge_embeddings: The input edge embeddings, of shape
             (batch_size, seq_length, d_model)
         :param cutoff_factors: The cutoff factors for the edges, of shape
-            (batch_size, seq_length, seq_length)
+            (batch_size, seq_length, seq_length), or (batch_size, 1, seq_length) if
+            they are the same for all queries.
         :param use_manual_attention: Whether to use the manual attention implementation
             (which supports double backward, needed for training with conservative
             forces), or the built-in PyTorch attention (which does not support double
@@ -385,9 +446,23 @@ class Transformer(torch.nn.Module):
             - The output node embeddings, of shape (batch_size, d_model)
             - The output edge embeddings, of shape (batch_size, seq_length, d_model)
         """
+        # all the layers use the same cutoff factors, so the attention bias is only
+        # computed again when a layer uses a different epsilon than the previous one
+        attention_bias: Optional[torch.Tensor] = None
+        attention_bias_epsilon = 0.0
         for layer in self.layers:
+            epsilon = layer.attention.epsilon
+            if attention_bias is None or epsilon != attention_bias_epsilon:
+                attention_bias = cutoff_factors_to_attention_bias(
+                    cutoff_factors, epsilon
+                )
+                attention_bias_epsilon = epsilon
             node_embeddings, edge_embeddings = layer(
-                node_embeddings, edge_embeddings, cutoff_factors, use_manual_attention
+                node_embeddings,
+                edge_embeddings,
+                cutoff_factors,
+                use_manual_attention,
+                attention_bias,
             )
         return node_embeddings, edge_embeddings
 
@@ -536,8 +611,11 @@ class CartesianTransformer(torch.nn.Module):
         cutoff_factors = torch.cat([cutoff_subfactors[:, None], cutoff_factors], dim=1)
         cutoff_factors[~total_padding_mask] = 0.0
 
+        # The cutoff factors only depend on the key token, so they are passed with a
+        # single query row, of shape (n_nodes, 1, max_num_neighbors + 1), which
+        # broadcasts over all queries in the attention, instead of being repeated
+        # into a (n_nodes, max_num_neighbors + 1, max_num_neighbors + 1) tensor.
         cutoff_factors = cutoff_factors[:, None, :]
-        cutoff_factors = cutoff_factors.repeat(1, cutoff_factors.shape[2], 1)
 
         initial_num_tokens = edge_vectors.shape[1]
         max_num_tokens = input_messages.shape[1]
@@ -545,9 +623,7 @@ class CartesianTransformer(torch.nn.Module):
         output_node_embeddings, output_edge_embeddings = self.trans(
             node_embeddings[:, None, :],
             edge_tokens[:, :max_num_tokens, :],
-            cutoff_factors=cutoff_factors[
-                :, : (max_num_tokens + 1), : (max_num_tokens + 1)
-            ],
+            cutoff_factors=cutoff_factors[:, :, : (max_num_tokens + 1)],
             use_manual_attention=use_manual_attention,
         )
         if max_num_tokens < initial_num_tokens:
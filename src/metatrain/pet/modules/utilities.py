@@ -12,7 +12,8 @@ def cutoff_func_bump(
     from 1 and to 0.
 
     :param values: Distances at which to evaluate the cutoff function.
-    :param cutoff: Cutoff radius for each node.
+    :param cutoff: Cutoff radius for each value, or a single cutoff radius (as a
+        scalar tensor) shared by all values.
     :param width: Width of the cutoff region.
     :return: Values of the cutoff function at the specified distances.
     """
@@ -29,7 +30,8 @@ def cutoff_func_cosine(
     Cosine cutoff function.
 
     :param values: Distances at which to evaluate the cutoff function.
-    :param cutoff: Cutoff radius for each node.
+    :param cutoff: Cutoff radius for each value, or a single cutoff radius (as a
+        scalar tensor) shared by all values.
     :param width: Width of the cutoff region.
     :return: Values of the cutoff function at the specified distances.
     """
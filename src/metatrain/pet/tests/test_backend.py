@@ -11,13 +11,19 @@ import warnings
 import metatensor.torch as mts
 import pytest
 import torch
+from metatensor.torch import Labels
 from metatomic.torch import ModelOutput, System, register_autograd_neighbors
 
 from metatrain.pet import PET
+from metatrain.pet.modules.nef import get_corresponding_edges
 from metatrain.pet.modules.structures import concatenate_structures
 from metatrain.utils.data import DatasetInfo
-from metatrain.utils.data.target_info import get_energy_target_info
+from metatrain.utils.data.target_info import (
+    get_energy_target_info,
+    get_generic_target_info,
+)
 from metatrain.utils.neighbor_lists import get_system_with_neighbor_lists
+from metatrain.utils.sum_over_atoms import sum_over_atoms
 
 from . import MODEL_HYPERS
 
@@ -150,6 +156,215 @@ def test_backend_runs_on_plain_tensors():
     assert all(isinstance(t, torch.Tensor) for t in atomic_predictions["energy"])
 
 
+def test_backend_element_indices_are_int32():
+    """The species indices scattered to the NEF grid use the narrow ``int32`` type."""
+    model = PET(MODEL_HYPERS, _make_dataset_info()).eval()
+    batch_data = model.backend.preprocess(*_backend_inputs(model, _make_system(model)))
+
+    assert batch_data["element_indices_nodes"].dtype == torch.int32
+    assert batch_data["element_indices_neighbors"].dtype == torch.int32
+
+
+def test_corresponding_edges():
+    """Each edge is matched to the edge going in the opposite direction."""
+    model = PET(MODEL_HYPERS, _make_dataset_info())
+    inputs = _backend_inputs(model, _make_periodic_system(model))
+    centers, neighbors, cell_shifts = inputs[1], inputs[2], inputs[5]
+
+    corresponding_edges = get_corresponding_edges(centers, neighbors, cell_shifts)
+
+    assert torch.equal(centers[corresponding_edges], neighbors)
+    assert torch.equal(neighbors[corresponding_edges], centers)
+    assert torch.equal(cell_shifts[corresponding_edges], -cell_shifts)
+    assert torch.equal(
+        corresponding_edges[corresponding_edges], torch.arange(len(centers))
+    )
+
+
+def test_reverse_neighbor_index_is_permutation():
+    """The reversed neighbor index is a permutation of the flattened NEF grid, with
+    padded entries pointing to themselves."""
+    model = PET(MODEL_HYPERS, _make_dataset_info()).eval()
+    backend = model.backend
+    # pad the NEF grid, so that there are padded entries
+    backend.bucket_nef_width = True
+    backend._nef_width_bucket = 16
+
+    for system in [_make_system(model), _make_periodic_system(model)]:
+        batch_data = backend.preprocess(*_backend_inputs(model, system))
+        padding_mask = batch_data["padding_mask"].reshape(-1)
+        reverse_neighbor_index = batch_data["reverse_neighbor_index"].reshape(-1)
+        assert not padding_mask.all()
+
+        indices = torch.arange(len(reverse_neighbor_index))
+        assert torch.equal(torch.sort(reverse_neighbor_index).values, indices)
+        assert torch.equal(
+            reverse_neighbor_index[~padding_mask], indices[~padding_mask]
+        )
+        # reversing twice gives back the original edge
+        assert torch.equal(reverse_neighbor_index[reverse_neighbor_index], indices)
+
+
+def test_backend_corresponding_edges_cache():
+    """With ``reuse_graph``, the corresponding edges are reused in evaluation only for
+    identical edges."""
+    model = PET(MODEL_HYPERS, _make_dataset_info()).eval()
+    backend = model.backend
+    inputs = _backend_inputs(model, _make_system(model))
+
+    # the cache is not used by default
+    backend.preprocess(*inputs)
+    assert len(backend._corresponding_edges_cache) == 0
+
+    backend.reuse_graph = True
+    reference = backend.preprocess(*inputs)
+    cached_edges = backend._corresponding_edges_cache[1]
+
+    # same edges: the cached corresponding edges are reused, with the same result
+    batch_data = backend.preprocess(*inputs)
+    assert backend._corresponding_edges_cache[1] is cached_edges
+    for key in reference:
+        torch.testing.assert_close(batch_data[key], reference[key])
+
+    # different edges: the cache is refreshed
+    backend.preprocess(*_backend_inputs(model, _make_periodic_system(model)))
+    assert backend._corresponding_edges_cache[1] is not cached_edges
+
+    # the cache is not used in training mode
+    backend.train()
+    backend._corresponding_edges_cache.clear()
+    backend.preprocess(*inputs)
+    assert len(backend._corresponding_edges_cache) == 0
+
+
+def test_corresponding_edges_cache_not_exported():
+    """The cached corresponding edges are dropped at export and in training mode."""
+    model = PET(MODEL_HYPERS, _make_dataset_info()).eval()
+    model.backend.reuse_graph = True
+    system = _make_system(model)
+
+    model([system], {"energy": ModelOutput(sample_kind="system")})
+    assert len(model.backend._corresponding_edges_cache) == 2
+    model.export()
+    assert len(model.backend._corresponding_edges_cache) == 0
+
+    model([system], {"energy": ModelOutput(sample_kind="system")})
+    assert len(model.backend._corresponding_edges_cache) == 2
+    model.train()
+    assert len(model.backend._corresponding_edges_cache) == 0
+
+
+def test_export_restores_eager_featurizer():
+    """Exporting removes a featurizer replaced on the backend instance, such as the
+    one set by ``compile_calculate_features``."""
+    model = PET(MODEL_HYPERS, _make_dataset_info()).eval()
+    model.backend.calculate_features = model.backend.calculate_features
+    model.export()
+    assert "calculate_features" not in model.backend.__dict__
+
+
+def test_backend_bucket_nef_width():
+    """Padding the NEF grid to a power-of-two bucket does not change the predictions."""
+    model = PET(MODEL_HYPERS, _make_dataset_info()).eval()
+    backend = model.backend
+    system = _make_system(model)
+    reference = model([system], {"energy": ModelOutput(sample_kind="atom")})
+
+    backend.bucket_nef_width = True
+    inputs = _backend_inputs(model, system)
+    batch_data = backend.preprocess(*inputs)
+    # the water molecule has two neighbors per atom, padded to a bucket of 2
+    assert batch_data["padding_mask"].shape == (3, 2)
+    assert backend._nef_width_bucket == 2
+
+    # the bucket never shrinks, so the smaller system is padded to the same width
+    backend._nef_width_bucket = 8
+    batch_data = backend.preprocess(*inputs)
+    assert batch_data["padding_mask"].shape == (3, 8)
+    assert backend._nef_width_bucket == 8
+
+    bucketed = model([system], {"energy": ModelOutput(sample_kind="atom")})
+    torch.testing.assert_close(
+        bucketed["energy"].block().values, reference["energy"].block().values
+    )
+
+
+# on CPU, the fused RMSNorm kernel does not support mixed input and weight dtypes
+@pytest.mark.filterwarnings(
+    "ignore:Mismatch dtype between input and weight:UserWarning"
+)
+def test_backend_autocast():
+    """Autocast runs the GNN layers in low precision and returns full-precision
+    features, close to the ones computed without autocast."""
+    model = PET(MODEL_HYPERS, _make_dataset_info()).eval()
+    backend = model.backend
+    batch_data = backend.preprocess(*_backend_inputs(model, _make_system(model)))
+    reference, _ = backend.calculate_features(batch_data)
+
+    backend.autocast_dtype = torch.bfloat16
+    node_features, _ = backend.calculate_features(batch_data)
+
+    for features, expected in zip(node_features, reference, strict=True):
+        assert features.dtype == torch.float32
+        torch.testing.assert_close(features, expected, atol=0.1, rtol=0.1)
+
+
+def test_backend_fused_last_layers():
+    """Applying the last layers of all blocks of an output at once gives the same
+    predictions as applying them block by block."""
+    dataset_info = DatasetInfo(
+        length_unit="Angstrom",
+        atomic_types=[1, 6, 7, 8],
+        targets={
+            "mtt::spherical": get_generic_target_info(
+                "mtt::spherical",
+                {
+                    "quantity": "",
+                    "unit": "",
+                    "type": {
+                        "spherical": {
+                            "irreps": [
+                                {"o3_lambda": 0, "o3_sigma": 1},
+                                {"o3_lambda": 1, "o3_sigma": 1},
+                                {"o3_lambda": 2, "o3_sigma": 1},
+                            ]
+                        }
+                    },
+                    "num_subtargets": 2,
+                    "sample_kind": "atom",
+                },
+            )
+        },
+    )
+    model = PET(MODEL_HYPERS, dataset_info).eval()
+    backend = model.backend
+    inputs = _backend_inputs(model, _make_system(model))
+    cells = inputs[4]
+    system_indices = inputs[6]
+    batch_data = backend.preprocess(*inputs)
+    node_list, edge_list = backend.calculate_features(batch_data)
+
+    fused, _, _ = backend.predict(
+        node_list, edge_list, batch_data, cells, system_indices, ["mtt::spherical"]
+    )
+    # with diagnostics, the last layers are called block by block
+    by_block, _, _ = backend.predict(
+        node_list,
+        edge_list,
+        batch_data,
+        cells,
+        system_indices,
+        ["mtt::spherical"],
+        capture_diagnostics=True,
+    )
+
+    assert len(fused["mtt::spherical"]) == 3
+    for fused_block, expected in zip(
+        fused["mtt::spherical"], by_block["mtt::spherical"], strict=True
+    ):
+        torch.testing.assert_close(fused_block, expected)
+
+
 def test_backend_predictions_match_full_model():
     """The backend's per-block predictions match the wrapped model's energy output."""
     model = PET(MODEL_HYPERS, _make_dataset_info()).eval()
@@ -173,6 +388,43 @@ def test_backend_predictions_match_full_model():
     torch.testing.assert_close(atomic_predictions["energy"][0], wrapped)
 
 
+def test_per_system_outputs_match_sum_over_atoms():
+    """Per-system outputs summed on dense values match ``sum_over_atoms`` applied to
+    the per-atom outputs, with and without selected atoms."""
+    model = PET(MODEL_HYPERS, _make_dataset_info()).eval()
+    systems = [_make_system(model), _make_periodic_system(model)]
+    names = ["energy", "feature", "mtt::aux::energy_last_layer_features"]
+
+    per_atom = model(systems, {name: ModelOutput(sample_kind="atom") for name in names})
+    per_system = model(
+        systems, {name: ModelOutput(sample_kind="system") for name in names}
+    )
+
+    # only select the atoms of the first system, so that the second system is dropped
+    selected_atoms = Labels(["system", "atom"], torch.tensor([[0, 0], [0, 1], [0, 2]]))
+    per_system_selected = model(
+        systems,
+        {name: ModelOutput(sample_kind="system") for name in names},
+        selected_atoms=selected_atoms,
+    )
+
+    for name in names:
+        expected = sum_over_atoms(per_atom[name])
+        expected_selected = sum_over_atoms(
+            mts.slice(per_atom[name], axis="samples", selection=selected_atoms)
+        )
+        for tensor, reference in [
+            (per_system[name], expected),
+            (per_system_selected[name], expected_selected),
+        ]:
+            assert tensor.keys == reference.keys
+            for block, reference_block in zip(
+                tensor.blocks(), reference.blocks(), strict=True
+            ):
+                assert block.samples == reference_block.samples
+                torch.testing.assert_close(block.values, reference_block.values)
+
+
 @pytest.mark.parametrize("fullgraph", [True, False])
 def test_backend_torch_compile(fullgraph):
     """``torch.compile`` of the backend matches eager execution, end to end.
@@ -301,3 +553,25 @@ def test_backend_torch_compile(fullgraph):
     torch.testing.assert_close(energy_backend, energy_full)
     torch.testing.assert_close(forces_backend, forces_full)
     torch.testing.assert_close(strain_grad_backend, strain_grad_full)
+
+    # ``compile_calculate_features`` does not use ``fullgraph``, so it is only checked
+    # once. It replaces the (here already compiled) featurizer on the instance, and
+    # deleting it gives back the eager featurizer.
+    if not fullgraph:
+        del backend.calculate_features
+        reference = backend.calculate_features(batch_data_e)
+
+        backend.compile_calculate_features(mode="default")
+        assert backend.bucket_nef_width
+        assert "calculate_features" in backend.__dict__
+        # a fallback to eager would emit a warning, which is an error in the tests
+        compiled = backend.calculate_features(batch_data_e)
+
+        del backend.calculate_features
+        assert "calculate_features" not in backend.__dict__
+        eager = backend.calculate_features(batch_data_e)
+
+        for features in [compiled, eager]:
+            for tensors, expected in zip(features, reference, strict=True):
+                for tensor, expected_tensor in zip(tensors, expected, strict=True):
+                    torch.testing.assert_close(tensor, expected_tensor)
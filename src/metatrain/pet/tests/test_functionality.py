@@ -11,13 +11,20 @@ from metatomic_ase import MetatomicCalculator
 
 from metatrain.composition import Trainer as CompositionTrainer
 from metatrain.pet import PET
-from metatrain.pet.modules.transformer import AttentionBlock
+from metatrain.pet.modules.transformer import (
+    AttentionBlock,
+    Transformer,
+    TransformerLayer,
+)
 from metatrain.utils.data import Dataset, DatasetInfo
 from metatrain.utils.data.target_info import (
     get_energy_target_info,
     get_generic_target_info,
 )
-from metatrain.utils.neighbor_lists import get_system_with_neighbor_lists
+from metatrain.utils.neighbor_lists import (
+    get_requested_neighbor_lists,
+    get_system_with_neighbor_lists,
+)
 
 from . import MODEL_HYPERS
 
@@ -180,6 +187,39 @@ def test_consistency():
     assert torch.allclose(attention_output_torch, attention_output_manual, atol=1e-6)
 
 
+def test_transformer_attention_epsilon():
+    """Tests that the layers of a transformer use the epsilon of their attention
+    block, although the attention bias is shared between them."""
+    torch.manual_seed(0)
+    transformer = Transformer(d_model=16, num_layers=2, n_heads=2, dim_node_features=16)
+    for layer in transformer.layers:
+        layer.attention.epsilon = 1e-3
+
+    node_embeddings = torch.randn(5, 1, 16)
+    edge_embeddings = torch.randn(5, 4, 16)
+    cutoff_factors = torch.rand(5, 1, 5)
+    cutoff_factors[:, :, -1] = 0.0
+
+    output = transformer(
+        node_embeddings, edge_embeddings, cutoff_factors, use_manual_attention=True
+    )
+
+    expected = (node_embeddings, edge_embeddings)
+    for layer in transformer.layers:
+        expected = layer(*expected, cutoff_factors, use_manual_attention=True)
+
+    torch.testing.assert_close(output[0], expected[0])
+    torch.testing.assert_close(output[1], expected[1])
+
+
+def test_unknown_transformer_type():
+    """Tests that transformer layers reject unknown transformer types."""
+    with pytest.raises(ValueError, match="Unknown transformer flag"):
+        TransformerLayer(
+            d_model=16, n_heads=2, dim_node_features=16, transformer_type="MidLN"
+        )
+
+
 @pytest.mark.skipif(not torch.cuda.is_available(), reason="requires a CUDA device")
 def test_attention_above_cuda_grid_limit():
     """Above 65535 nodes, SDPA's CUDA backward overflows the grid limit and crashes;
@@ -316,6 +356,79 @@ def test_slab_plus_isolated_atom(monkeypatch, tmp_path):
     dyn.run(3)
 
 
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="requires a CUDA device")
+def test_additive_models_side_stream(monkeypatch):
+    """Tests that evaluating the additive models (composition and ZBL) on a side
+    CUDA stream gives the same outputs as evaluating them serially."""
+    dataset_info = DatasetInfo(
+        length_unit="angstrom",
+        atomic_types=[1, 6, 7, 8],
+        targets={
+            "energy": get_energy_target_info(
+                "energy", {"quantity": "energy", "unit": "eV"}
+            )
+        },
+    )
+    hypers = copy.deepcopy(MODEL_HYPERS)
+    hypers["zbl"] = True
+    model = PET(hypers, dataset_info)
+
+    composition_trainer = CompositionTrainer(
+        hypers={
+            "atomic_baseline": {"energy": {1: -0.5, 6: -1.0, 7: -1.5, 8: -2.0}},
+            "batch_size": 1,
+        }
+    )
+    composition_trainer.train(
+        model=model.additive_models[0],
+        dtype=torch.float64,
+        devices=[torch.device("cpu")],
+        train_datasets=[],
+        val_datasets=[],
+        checkpoint_dir="",
+    )
+    model = model.to("cuda").eval()
+
+    systems = [
+        System(
+            types=torch.tensor([6, 1, 8]),
+            positions=torch.tensor([[0.0, 0.0, 0.0], [0.0, 0.0, 0.8], [0.0, 1.2, 0.0]]),
+            cell=torch.zeros(3, 3),
+            pbc=torch.tensor([False, False, False]),
+        ),
+        System(
+            types=torch.tensor([7, 7]),
+            positions=torch.tensor([[0.0, 0.0, 0.0], [0.0, 0.0, 1.1]]),
+            cell=torch.zeros(3, 3),
+            pbc=torch.tensor([False, False, False]),
+        ),
+    ]
+    requested_neighbor_lists = get_requested_neighbor_lists(model)
+    systems = [
+        get_system_with_neighbor_lists(system, requested_neighbor_lists).to(
+            device="cuda"
+        )
+        for system in systems
+    ]
+
+    for sample_kind in ["system", "atom"]:
+        outputs = {"energy": ModelOutput(sample_kind=sample_kind)}
+        side_stream = model(systems, outputs)["energy"]
+
+        with monkeypatch.context() as context:
+            # without contributions launched on the side stream, the additive
+            # models are evaluated serially after the last layers
+            context.setattr(
+                model,
+                "_launch_additive_models_on_side_stream",
+                lambda systems, outputs, selected_atoms: None,
+            )
+            serial = model(systems, outputs)["energy"]
+
+        assert side_stream.block().samples == serial.block().samples
+        torch.testing.assert_close(side_stream.block().values, serial.block().values)
+
+
 def test_composition_contribution_in_eval_atomic_basis():
     """Tests that the composition contribution is present in the eval-mode
     output for an atomic-basis target.
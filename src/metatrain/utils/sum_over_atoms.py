@@ -6,6 +6,24 @@ from metatensor.torch import Labels, TensorBlock, TensorMap
 from . import torch_jit_script_unless_coverage
 
 
+@torch_jit_script_unless_coverage
+def sum_values_over_atoms(
+    values: torch.Tensor, system_indices: torch.Tensor, n_systems: int
+) -> torch.Tensor:
+    """
+    Sum dense per-atom values over the atoms of each system.
+
+    :param values: Per-atom values, with the atoms along the first dimension.
+    :param system_indices: System index for each atom, with shape ``(n_atoms,)``.
+    :param n_systems: Number of systems, i.e. number of rows of the output.
+    :return: Per-system values, with shape ``(n_systems, *values.shape[1:])``.
+    """
+    summed = torch.zeros(
+        [n_systems] + list(values.shape[1:]), device=values.device, dtype=values.dtype
+    )
+    return summed.index_add_(0, system_indices, values)
+
+
 @torch_jit_script_unless_coverage
 def sum_over_atoms(tensor_map: TensorMap) -> TensorMap:
     """
@@ -19,16 +37,12 @@ def sum_over_atoms(tensor_map: TensorMap) -> TensorMap:
     new_blocks: List[TensorBlock] = []
     for block in tensor_map.blocks():
         device = block.values.device
-        dtype = block.values.dtype
         system_samples = block.samples.column("system")
         if system_samples.numel() == 0:
             n_systems = 0
         else:
             n_systems = int(system_samples.max()) + 1
-        new_tensor = torch.zeros(
-            [n_systems] + list(block.values.shape[1:]), device=device, dtype=dtype
-        )
-        new_tensor.index_add_(0, block.samples.column("system"), block.values)
+        new_tensor = sum_values_over_atoms(block.values, system_samples, n_systems)
         new_block = TensorBlock(
             values=new_tensor,
             samples=Labels(
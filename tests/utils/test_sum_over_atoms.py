@@ -2,7 +2,7 @@ import metatensor.torch as mts
 import torch
 from metatensor.torch import Labels, TensorBlock, TensorMap
 
-from metatrain.utils.sum_over_atoms import sum_over_atoms
+from metatrain.utils.sum_over_atoms import sum_over_atoms, sum_values_over_atoms
 
 
 def test_sum_over_atoms():
@@ -67,3 +67,14 @@ def test_sum_over_atoms_empty():
     assert summed_block.values.shape == (0, 2, 1)
     assert summed_block.samples.names == ["system"]
     assert len(summed_block.samples) == 0
+
+
+def test_sum_values_over_atoms():
+    """Test summing dense values, including systems without atoms."""
+    values = torch.tensor([[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]])
+    system_indices = torch.tensor([0, 0, 2])
+
+    summed = sum_values_over_atoms(values, system_indices, 4)
+
+    expected = torch.tensor([[4.0, 6.0], [0.0, 0.0], [5.0, 6.0], [0.0, 0.0]])
+    torch.testing.assert_close(summed, expected)